@@ -1,5 +1,103 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
 import numpy as np
 
+from lookup_table import LookupTable
+from rule_table import load_policies, load_policy
+
+'''
+Aggregation functions combine the credibility results of the modules into one final label.
+
+There are two kinds of aggregators:
+ - per-row functions receive one request in form of {module name: {'cred': value, 'conf': value}} and return a label
+ - batch functions (marked with @batch) receive two float arrays creds and confs of shape (n_samples, n_modules),
+   with the modules in order of MODULES, and return an int8 array of label codes (indexes of LABELS)
+
+Use get_batch to get a batch version of any aggregator, per-row functions are wrapped with an adapter.
+Rule-table policies in POLICY_DIR are registered by file name, see rule_table.py. Lookup tables of expensive
+aggregators (lookup_table.py) are used by the path of their .npy file.
+'''
+
+LABELS = ['credible', 'mostly_credible', 'mostly_not_credible', 'credible_uncertain', 'not_credible',
+          'not_verifiable']
+NOT_VERIFIABLE = LABELS.index('not_verifiable')
+
+# module names of the requests, in column order of the batch arrays
+MODULES = ['misinfome', 'stance', 'claim_credibility']
+
+# credibility boundaries from credible to not credible and the minimum confidence of a module
+CRED_THRESHOLDS = [0.66, 0.33, -0.33, -0.66]
+CONF_THRESHOLD = 0.5
+
+POLICY_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / 'policies'
+
+
+def batch(func):
+    '''
+    Marks func as a batch aggregator
+    '''
+    func.batch = True
+    return func
+
+
+def per_row(func, modules=MODULES):
+    '''
+    Adapter which runs a per-row aggregator over batch arrays
+    :param func: per-row aggregator, returns a label for one request
+    :type func: function
+    :param modules: module names of the array columns
+    :type modules: list
+    :return: batch aggregator
+    :rtype: function
+    '''
+    codes = {label: code for code, label in enumerate(LABELS)}
+
+    @batch
+    def adapter(creds, confs):
+        results = np.empty(creds.shape[0], dtype=np.int8)
+        for i in range(creds.shape[0]):
+            request = {module: {'cred': creds[i, j], 'conf': confs[i, j]} for j, module in enumerate(modules)}
+            results[i] = codes[func(request)]
+        return results
+
+    return adapter
+
+
+def get_batch(name, modules=MODULES):
+    '''
+    :param name: name of a registered aggregator, path of a policy json or of a lookup table
+    :type name: str
+    :param modules: module names of the array columns, policies need rules for each of them
+    :type modules: list
+    :return: batch aggregator
+    :rtype: function
+    :raises ValueError: if the aggregator does not support the modules
+    '''
+    if name not in methods and name.endswith('.json'):
+        return load_policy(name, LABELS, modules)
+    if name not in methods and name.endswith('.npy'):
+        table = LookupTable.load(name, mmap=True)
+        if table.n_modules != len(modules):
+            raise ValueError('Lookup table of {} modules got {} modules'.format(table.n_modules, len(modules)))
+        return table
+    if name in policies and list(modules) != MODULES:
+        return load_policy(POLICY_DIR / (name + '.json'), LABELS, modules)
+    func = methods[name]
+    return func if getattr(func, 'batch', False) else per_row(func, modules)
+
+
+def _cred_to_label(cred, verified):
+    '''
+    Maps credibility values to label codes with CRED_THRESHOLDS, rows which are not verified get not_verifiable
+    '''
+    bounds = np.asarray(CRED_THRESHOLDS[::-1])
+    codes = len(bounds) - np.searchsorted(bounds, cred, side='right')
+    return np.where(verified, codes, NOT_VERIFIABLE).astype(np.int8)
+
+
 # this is default method
 
 '''
@@ -9,11 +107,12 @@ get all values and take average, then set it to final label
 '''
 
 
-def default(credibility_results):
-    count = 0
-    for module_name, result in credibility_results.items():
-        if (result.cred):
-            pass
+@batch
+def default(creds, confs):
+    confident = confs >= CONF_THRESHOLD
+    n_confident = confident.sum(axis=1)
+    mean = np.where(confident, creds, 0).sum(axis=1) / np.maximum(n_confident, 1)
+    return _cred_to_label(mean, n_confident > 0)
 
 
 def dummy_output(credibility_results):
@@ -22,11 +121,32 @@ def dummy_output(credibility_results):
     random_idx = np.random.randint(high=len(labels), low=0, size=1)[0]
     return labels[random_idx]
 
-def median(credibility_results):
-    pass
 
-def maximum(credibility_results):
-    pass
+@batch
+def median(creds, confs):
+    '''
+    Median credibility of the confident modules
+    '''
+    confident = confs >= CONF_THRESHOLD
+    n_confident = confident.sum(axis=1)
+    # not confident modules are sorted to the end of each row
+    ordered = np.sort(np.where(confident, creds, np.inf), axis=1)
+    lower = np.take_along_axis(ordered, np.maximum(n_confident - 1, 0)[:, None] // 2, axis=1)[:, 0]
+    upper = np.take_along_axis(ordered, n_confident[:, None] // 2, axis=1)[:, 0]
+    verified = n_confident > 0
+    return _cred_to_label(np.where(verified, (lower + upper) / 2, 0), verified)
+
+
+@batch
+def maximum(creds, confs):
+    '''
+    Credibility of the module with the highest confidence
+    '''
+    most_confident = np.argmax(np.nan_to_num(confs, nan=-np.inf), axis=1)[:, None]
+    cred = np.take_along_axis(creds, most_confident, axis=1)[:, 0]
+    conf = np.take_along_axis(confs, most_confident, axis=1)[:, 0]
+    return _cred_to_label(cred, conf >= CONF_THRESHOLD)
+
 
 methods = {
 
@@ -36,3 +156,47 @@ methods = {
     'maximum': maximum
 
 }
+
+policies = load_policies(POLICY_DIR, LABELS, MODULES)
+methods.update(policies)
+
+
+def check_missing_modules(aggregate, n_modules=len(MODULES), n_samples=10000, seed=42):
+    '''
+    Checks that the aggregator treats modules with NaN cred and conf, e.g. the failed modules of the collected
+    responses, as modules without confidence: rows with masked modules get the label of the same rows with conf 0
+    :return: rows with different labels, None if the aggregator gives different labels for the same rows
+    :rtype: int
+    '''
+    rng = np.random.default_rng(seed)
+    creds = rng.uniform(-1, 1, size=(n_samples, n_modules))
+    confs = rng.uniform(0, 1, size=(n_samples, n_modules))
+    masked = rng.uniform(size=(n_samples, n_modules)) < 0.3
+    unconfident = aggregate(creds, np.where(masked, 0, confs))
+    if (aggregate(creds, np.where(masked, 0, confs)) != unconfident).any():
+        return None
+    return int((aggregate(np.where(masked, np.nan, creds), np.where(masked, np.nan, confs)) != unconfident).sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aggregate_func', type=str, nargs='+', default=list(methods),
+                        help="aggregators to check, by default every registered one")
+    parser.add_argument('--n_samples', type=int, default=10000)
+    args = parser.parse_args(argv)
+    failed = []
+    for name in args.aggregate_func:
+        mismatches = check_missing_modules(get_batch(name), n_samples=args.n_samples)
+        if mismatches is None:
+            print('{:<20} skipped, not deterministic'.format(name))
+            continue
+        print('{:<20} {} of {} rows with NaN modules differ from unconfident modules'.format(
+            name, mismatches, args.n_samples))
+        if mismatches:
+            failed.append(name)
+    if failed:
+        sys.exit('Aggregators which do not treat NaN modules as unconfident: {}'.format(failed))
+
+
+if __name__ == '__main__':
+    main()
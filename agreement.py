@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+'''
+Inter-rater agreement of the fact-checking label coders
+
+The coders map every fact-checker label to a system label. Agreement is measured with Fleiss' kappa computed from an
+items by categories count matrix, items may have a different number of ratings. Bootstrap confidence intervals
+resample the items, the replicates are drawn in batches from their own random streams so the intervals do not
+depend on the number of workers. The majority label of the items gives the fact-checker to system label mapping.
+'''
+
+DATA_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / 'data'
+RATINGS_FILE = DATA_DIR / 'misinfome' / 'fact_checking_labels.tsv'
+
+# replicates drawn at a time, also the unit of work of the bootstrap workers
+BOOTSTRAP_BATCH = 16
+
+# label noise of the coders, applied in order after stripping and replacing spaces by _
+LABEL_FIXES = [('notcredible', 'not_credible'), ('mostlycredible', 'mostly_credible')]
+
+
+def read_ratings(path=RATINGS_FILE):
+    '''
+    Reads the coded fact-checking labels, the coder columns are all columns between the first one and the last two
+    :return: fact-checker labels, ratings with one column per coder
+    :rtype: tuple
+    '''
+    data = pd.read_csv(path, sep='\t')
+    return data['fact_checking_label'], data.iloc[:, 1:-2]
+
+
+def normalize_labels(labels):
+    '''
+    Fixes the label noise of the coders, e.g. ' mostly credible' -> 'mostly_credible'
+    :type labels: pandas.Series
+    :rtype: pandas.Series
+    '''
+    labels = labels.astype(object).str.replace('\xa0', ' ', regex=False).str.replace('\xc2', '', regex=False)
+    labels = labels.str.strip().str.replace(' ', '_', regex=False).str.lstrip('_')
+    for old, new in LABEL_FIXES:
+        labels = labels.str.replace(old, new, regex=False)
+    return labels
+
+
+def count_matrix(ratings, categories=None):
+    '''
+    :param ratings: one row per item and one column per rater, missing ratings are NaN
+    :type ratings: pandas.DataFrame
+    :param categories: categories in column order of the counts, by default the sorted categories of the ratings
+    :type categories: list
+    :return: counts of shape (items, categories), categories
+    :rtype: tuple
+    '''
+    values = ratings.to_numpy(dtype=object).ravel()
+    codes = pd.Categorical(values, categories=categories)
+    categories = list(codes.categories)
+    codes = codes.codes.reshape(ratings.shape).astype(np.int64)
+    rated = codes >= 0
+    cells = np.arange(ratings.shape[0])[:, None] * len(categories) + codes
+    counts = np.bincount(cells[rated], minlength=ratings.shape[0] * len(categories))
+    return counts.reshape(ratings.shape[0], len(categories)), categories
+
+
+def _item_terms(counts):
+    '''
+    Per item terms of the kappa sums, items with less than two ratings do not count
+    :return: columns [agreement P_i, ratings n_i, counts n_ij..., disagreement of each category...]
+    :rtype: numpy.ndarray
+    '''
+    counts = np.asarray(counts, dtype=np.float64)
+    ratings = counts.sum(axis=1)
+    counts = counts[ratings >= 2]
+    ratings = ratings[ratings >= 2]
+    pairs = ratings * (ratings - 1)
+    agreement = ((counts ** 2).sum(axis=1) - ratings) / pairs
+    disagreement = counts * (ratings[:, None] - counts) / pairs[:, None]
+    return np.column_stack([agreement, ratings, counts, disagreement])
+
+
+def _kappa(sums, items):
+    '''
+    :param sums: weighted sums of the item terms of shape (..., terms)
+    :param items: weighted number of items of shape (...)
+    :return: kappa of shape (...) and per category kappa of shape (..., categories)
+    :rtype: tuple
+    '''
+    k = (sums.shape[-1] - 2) // 2
+    items = np.asarray(items, dtype=np.float64)[..., None]
+    observed = sums[..., 0] / items[..., 0]
+    proportions = sums[..., 2:2 + k] / sums[..., 1:2]
+    expected = (proportions ** 2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappa = (observed - expected) / (1 - expected)
+        per_category = 1 - sums[..., 2 + k:] / items / (proportions * (1 - proportions))
+    return kappa, per_category
+
+
+def fleiss_kappa(counts):
+    '''
+    Fleiss' kappa of an items by categories count matrix, the number of ratings may differ between items
+    :param counts: counts of shape (items, categories)
+    :type counts: numpy.ndarray
+    :return: kappa, per category kappa
+    :rtype: tuple
+    '''
+    terms = _item_terms(counts)
+    return _kappa(terms.sum(axis=0), terms.shape[0])
+
+
+# item terms of the bootstrap, sent once to each worker
+_terms = None
+
+
+def _set_terms(terms):
+    global _terms
+    _terms = terms
+
+
+def _bootstrap_batch(seed, batch, size, terms=None):
+    terms = _terms if terms is None else terms
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch,)))
+    n = terms.shape[0]
+    weights = np.stack([np.bincount(rng.integers(0, n, n), minlength=n) for _ in range(size)]).astype(np.float64)
+    return _kappa(weights @ terms, np.full(size, n))
+
+
+def bootstrap(counts, replicates=1000, confidence=0.95, seed=42, workers=1):
+    '''
+    Percentile bootstrap confidence intervals of the kappas, the items are resampled with replacement
+    :return: {'kappa': (low, high), 'per_category': (low, high) arrays}
+    :rtype: dict
+    '''
+    terms = _item_terms(counts)
+    batches = [(batch, min(BOOTSTRAP_BATCH, replicates - start))
+               for batch, start in enumerate(range(0, replicates, BOOTSTRAP_BATCH))]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_terms, initargs=(terms,)) as executor:
+            results = list(executor.map(_bootstrap_batch, *zip(*[(seed, batch, size) for batch, size in batches])))
+    else:
+        results = [_bootstrap_batch(seed, batch, size, terms) for batch, size in batches]
+    kappa = np.concatenate([result[0] for result in results])
+    per_category = np.concatenate([result[1] for result in results])
+    tails = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    return {'kappa': tuple(np.nanpercentile(kappa, tails)),
+            'per_category': tuple(np.nanpercentile(per_category, tails, axis=0))}
+
+
+def majority(counts, categories, min_ratings=3):
+    '''
+    :return: majority category of each item, None if the item has fewer ratings than min_ratings or a tie
+    :rtype: numpy.ndarray
+    '''
+    top = counts.max(axis=1)
+    unique = (counts == top[:, None]).sum(axis=1) == 1
+    valid = unique & (counts.sum(axis=1) >= min_ratings)
+    return np.where(valid, np.asarray(categories, dtype=object)[counts.argmax(axis=1)], None)
+
+
+def label_mapping(fact_checker_labels, ratings, min_ratings=3):
+    '''
+    Maps every fact-checker label on which the coders agree to their majority system label
+    :return: {fact-checker label: system label}
+    :rtype: dict
+    '''
+    ratings = ratings.apply(normalize_labels)
+    counts, categories = count_matrix(ratings)
+    labels = majority(counts, categories, min_ratings)
+    agreed = pd.notna(labels)
+    return dict(zip(fact_checker_labels[agreed], labels[agreed]))
+
+
+def map_labels(fact_checker_labels, mapping):
+    '''
+    :param fact_checker_labels: labels of the fact-checkers
+    :type fact_checker_labels: pandas.Series
+    :return: system labels, NaN for labels without mapping
+    :rtype: pandas.Series
+    '''
+    codes = pd.Categorical(fact_checker_labels, categories=list(mapping))
+    system_labels = np.asarray(list(mapping.values()) + [None], dtype=object)
+    return pd.Series(system_labels[codes.codes], index=fact_checker_labels.index)
+
+
+def run(args):
+    start = time.perf_counter()
+    fact_checker_labels, ratings = read_ratings(args.ratings)
+    counts, categories = count_matrix(ratings.apply(normalize_labels))
+    kappa, per_category = fleiss_kappa(counts)
+    results = {'items': int(counts.shape[0]), 'raters': int(ratings.shape[1]), 'kappa': float(kappa),
+               'per_category': dict(zip(categories, per_category.tolist()))}
+    if args.bootstrap:
+        intervals = bootstrap(counts, args.bootstrap, args.confidence, args.seed, args.workers)
+        results['kappa_interval'] = [float(value) for value in intervals['kappa']]
+        results['per_category_interval'] = {category: [float(low), float(high)] for category, low, high in
+                                            zip(categories, *intervals['per_category'])}
+    results['mapping'] = label_mapping(fact_checker_labels, ratings, args.min_ratings)
+    results['seconds'] = time.perf_counter() - start
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print('Fleiss kappa {:.4f} of {} items'.format(kappa, counts.shape[0]))
+    for category, value in results['per_category'].items():
+        print('{:<25} {:.4f}'.format(category, value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ratings', type=Path, default=RATINGS_FILE, help="tsv of the coded fact-checking labels")
+    parser.add_argument('--bootstrap', type=int, default=0, help="replicates of the bootstrap confidence intervals")
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help="processes drawing the bootstrap replicates")
+    parser.add_argument('--min_ratings', type=int, default=3, help="ratings an item needs for the label mapping")
+    parser.add_argument('--output', type=Path, default=DATA_DIR / 'misinfome' / 'agreement.json')
+    args = parser.parse_args()
+    run(args)
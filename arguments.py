@@ -0,0 +1,137 @@
+import argparse
+import os
+from pathlib import Path
+
+import timing
+
+'''
+Command line arguments of the pipeline commands
+
+The parsers only need the standard library, so `cli.py {command} --help` and wrong arguments are answered before a
+command loads numpy and pandas. Each script builds its parser from here.
+'''
+
+DATA_DIR = Path(os.path.dirname(os.path.dirname(__file__))) / Path(os.path.basename(os.path.dirname(__file__))) / 'data'
+# COINFORM_ENDPOINT of the commands which send requests, next to the scripts wherever they are run from
+ENV_FILE = DATA_DIR.parent / '.env'
+# folder in DATA_DIR with the results of all cases
+SUMMARY_DIR = 'summary'
+
+SAMPLE_MODES = ['all_not_verified', 'all_agree_all_high', 'some_agree', 'all_agree_some_high']
+
+RESPONSES_FILE = DATA_DIR / 'misinfome' / 'rule-responses' / 'export.csv'
+GOLD_FILES = [DATA_DIR / 'misinfome' / 'system_dataset_with5.csv', DATA_DIR / 'misinfome' / 'system_dataset_with6.csv']
+# response rows joined at a time
+JOIN_CHUNK_SIZE = 1000000
+
+
+def generate_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_samples', type=int, default=20)
+    parser.add_argument('--misinfome_cred', action='store',
+                        type=float, nargs=4, default=[0.66, 0.33, -0.33, -0.66],
+                        help="Examples: --misinfome_cred item1 item2")
+    parser.add_argument('--content_analysis_cred', action='store',
+                        type=float, nargs=4, default=[0.6, 0.3, -0.3, -0.6],
+                        help="Examples: --content_analysis_cred item1 item2")
+    parser.add_argument('--claim_cred', action='store',
+                        type=float, nargs=4, default=[0.5, 0.25, -0.5, -0.25],
+                        help="Examples: --claim_cred item1 item2")
+    parser.add_argument('--misinfome_conf',
+                        type=float, default=0.5)
+    parser.add_argument('--content_analysis_conf',
+                        type=float, default=0.6)
+    parser.add_argument('--claim_conf', type=float, default=0.7)
+    parser.add_argument('--chunk_size', type=int, default=None,
+                        help="rows generated and written at a time, keeps memory constant for large n_samples")
+    parser.add_argument('--output_format', type=str, default='csv', choices=['csv', 'binary', 'both'],
+                        help="csv file, binary case directory with float32 columns or both")
+    parser.add_argument('--seed', type=int, default=42, help="random seed, same samples for any number of workers")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes generating the chunks")
+    parser.add_argument('--n_modules', type=int, default=None,
+                        help="number of modules, by default the configured ones, further modules repeat them")
+    parser.add_argument('--modules_config', type=str, default=None,
+                        help="json file with the thresholds of each module instead of the threshold arguments")
+    parser.add_argument('--validate', type=str, default='report', choices=['off', 'report', 'fail'],
+                        help="check every row against the bands of its mode, fail does not complete a case with "
+                             "offending rows")
+    parser.add_argument('--max_violations', type=int, default=1000,
+                        help="offending values in the report of a case, all are counted")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="maximum number of requests in flight to the policy manager")
+    parser.add_argument('--query_timeout', type=float, default=120.0,
+                        help="seconds to wait for the modules of a tweet")
+    parser.add_argument('--response_ttl', type=float, default=None,
+                        help="seconds after which stored responses are requested again, by default never")
+    parser.add_argument('--sample_mode', type=str, default='external_misinfome',
+                        help="select sample mode, all_not_verified, all_agree_all_high, some_agree, "
+                             "all_agree_some_high or all to generate every mode in one run")
+    timing.add_arguments(parser, 'draw_bands')
+    return parser
+
+
+def evaluate_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aggregate_func', type=str, nargs='+', default=['default'],
+                        help="Select aggregate functions e.g sum, max, etc, all for every registered function. "
+                             "The cases are read once for all of them")
+    parser.add_argument('--chunk_size', type=int, default=1000000, help="rows aggregated at a time")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes evaluating the cases")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="processes evaluating the rows of each case over shared memory, for single large cases")
+    parser.add_argument('--data_dir', type=Path, default=DATA_DIR, help="folder of the cases")
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help="replicates of the bootstrap confidence intervals of the metrics, 0 for none")
+    parser.add_argument('--confidence', type=float, default=0.95, help="level of the confidence intervals")
+    parser.add_argument('--max_disagreements', type=int, default=100000,
+                        help="rows of the disagreement report of each case when several functions are evaluated")
+    parser.add_argument('--cache', type=Path, nargs='?', const=DATA_DIR / SUMMARY_DIR / 'results_cache.sqlite',
+                        default=None,
+                        help="cache the results by case content and aggregator source, reruns only evaluate new or "
+                             "changed cases, default data/summary/results_cache.sqlite")
+    parser.add_argument('--cache_size', type=float, default=64,
+                        help="MB of cached results, the least recently used ones are evicted")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and evaluate the cases of data_dir which change")
+    parser.add_argument('--watch_interval', type=float, default=2.0, help="seconds between polls of --watch")
+    timing.add_arguments(parser, 'aggregate')
+    return parser
+
+
+def join_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--responses', type=Path, default=RESPONSES_FILE, help="exported module responses")
+    parser.add_argument('--gold', type=Path, nargs='+', default=GOLD_FILES, help="gold label files of the notebook")
+    parser.add_argument('--data_dir', type=Path, default=DATA_DIR, help="folder of the joined cases")
+    parser.add_argument('--chunk_size', type=int, default=JOIN_CHUNK_SIZE, help="response rows joined at a time")
+    parser.add_argument('--aggregate_func', type=str, nargs='+', default=None,
+                        help="evaluate the joined cases with these aggregate functions")
+    timing.add_arguments(parser, 'join')
+    return parser
+
+
+def sweep_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aggregate_func', type=str, default='default',
+                        help="Select aggregate function e.g sum, max, etc")
+    parser.add_argument('--sample_mode', type=str, nargs='+', default=SAMPLE_MODES, choices=SAMPLE_MODES)
+    parser.add_argument('--n_samples', type=int, default=20)
+    parser.add_argument('--misinfome_cred', type=float, nargs='+', default=[0.66, 0.33, -0.33, -0.66],
+                        help="one or more sets of 4 thresholds")
+    parser.add_argument('--content_analysis_cred', type=float, nargs='+', default=[0.6, 0.3, -0.3, -0.6],
+                        help="one or more sets of 4 thresholds")
+    parser.add_argument('--claim_cred', type=float, nargs='+', default=[0.5, 0.25, -0.5, -0.25],
+                        help="one or more sets of 4 thresholds")
+    parser.add_argument('--misinfome_conf', type=float, nargs='+', default=[0.5],
+                        help="confidence or range: start stop step")
+    parser.add_argument('--content_analysis_conf', type=float, nargs='+', default=[0.6],
+                        help="confidence or range: start stop step")
+    parser.add_argument('--claim_conf', type=float, nargs='+', default=[0.7],
+                        help="confidence or range: start stop step")
+    parser.add_argument('--chunk_size', type=int, default=None, help="rows generated at a time")
+    parser.add_argument('--seed', type=int, default=42, help="random seed of every configuration")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--save_samples', action='store_true', help="also write the samples of each configuration, named by its index")
+    parser.add_argument('--output_format', type=str, default='csv', choices=['csv', 'binary', 'both'],
+                        help="format of the saved samples")
+    return parser
@@ -0,0 +1,226 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import evaluation
+from aggregators import LABELS, methods, get_batch
+from arguments import SAMPLE_MODES, evaluate_parser, generate_parser
+from sample_generator import BandValidator, Sample_Generator, scale_modules
+from sample_io import MODULE_COLUMNS, CaseWriter
+
+'''
+Benchmark suite for the generator modes, the band validation, the aggregators and the evaluation
+
+Measures rows per second and peak memory for several input sizes, writes the results as json and compares them
+against a stored baseline. The run fails if a benchmark got slower or uses more memory than the threshold allows.
+'''
+
+# aggregators which take any number of modules
+MODULE_AGNOSTIC = ['default', 'median', 'maximum']
+
+
+def rows_per_sample(mode, n_modules=3):
+    '''
+    Rows of the 5 label bands of a sample mode per n_samples, some_agree has 2 sections per module
+    '''
+    return 5 * 2 * n_modules if mode == 'some_agree' else 5
+
+
+def _measure(func, repeat, min_seconds=0.0):
+    '''
+    Runs func at least repeat times and until min_seconds have passed for the median time, which unlike the fastest
+    time does not depend on one lucky run, and once more with tracemalloc for the peak memory
+    :return: seconds, peak memory in MB
+    :rtype: tuple
+    '''
+    times = []
+    begin = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - begin < min_seconds:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    seconds = float(np.median(times))
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+
+def _generator(mode, rows, n_modules=3):
+    args = generate_parser().parse_args([])
+    args.n_samples = max(rows // rows_per_sample(mode, n_modules), 1)
+    args.n_modules = n_modules
+    sample_gen = Sample_Generator(args)
+
+    def generate():
+        for _ in sample_gen.chunks(mode):
+            pass
+
+    return generate
+
+
+def _validator(mode, rows):
+    args = generate_parser().parse_args([])
+    args.n_samples = max(rows // rows_per_sample(mode), 1)
+    sample_gen = Sample_Generator(args)
+    tasks = sample_gen._tasks(mode)
+    chunks = [sample_gen._chunk(task) for task in tasks]
+
+    def validate():
+        validator = BandValidator(sample_gen, mode, mode)
+        for task, data in zip(tasks, chunks):
+            validator(task, data)
+
+    return validate
+
+
+def _samples(rows, seed=42, n_modules=3):
+    rng = np.random.default_rng(seed)
+    creds = rng.uniform(-1, 1, size=(rows, n_modules))
+    confs = rng.uniform(0, 1, size=(rows, n_modules))
+    expected = rng.integers(0, len(LABELS), size=rows).astype(np.int8)
+    return creds, confs, expected
+
+
+def _aggregator(name, rows, n_modules=3):
+    creds, confs, _ = _samples(rows, n_modules=n_modules)
+    aggregate = get_batch(name)
+    return lambda: aggregate(creds, confs)
+
+
+def _write_case(data_dir, output_format, rows, n_modules=3):
+    creds, confs, expected = _samples(rows, n_modules=n_modules)
+    modules = list(scale_modules(dict.fromkeys(MODULE_COLUMNS), n_modules))
+    data = {'values': np.stack([creds, confs], axis=-1).astype(np.float32), 'expected_credible': expected}
+    labels = {label: code for code, label in enumerate(LABELS)}
+    with CaseWriter(data_dir / 'case', output_format, labels, modules) as writer:
+        writer.write(data)
+
+
+def _evaluation(data_dir, output_format, rows, n_modules=3):
+    _write_case(data_dir, output_format, rows, n_modules)
+    args = evaluate_parser().parse_args(['--data_dir', str(data_dir)])
+    return lambda: evaluation.run(args)
+
+
+def run_benchmarks(args, baseline=None):
+    '''
+    :param baseline: results of an earlier run, benchmarks which look slower than it are measured again up to
+        args.confirm times and the fastest measurement counts, so a single noisy measurement does not fail the run
+    :type baseline: dict
+    '''
+    results = []
+    reference = {} if baseline is None else {(result['name'], result['rows']): result
+                                             for result in baseline['results']}
+
+    def slower(name, rows, seconds):
+        result = reference.get((name, rows))
+        return (result is not None and result['seconds'] >= args.gate_min_seconds and
+                rows / seconds < (1 - args.threshold) * result['rows_per_second'])
+
+    def record(name, rows, func):
+        seconds, peak = _measure(func, args.repeat, args.min_seconds)
+        for _ in range(args.confirm):
+            if not slower(name, rows, seconds):
+                break
+            seconds = min(seconds, _measure(func, args.repeat, args.min_seconds)[0])
+        results.append({'name': name, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds,
+                        'peak_memory_mb': peak})
+        print('{:<40} {:>10} rows {:>14.0f} rows/s {:>10.1f} MB'.format(name, rows, rows / seconds, peak))
+
+    for rows in args.sizes:
+        for mode in SAMPLE_MODES:
+            n_rows = max(rows // rows_per_sample(mode), 1) * rows_per_sample(mode)
+            record('generator/' + mode, n_rows, _generator(mode, rows))
+            record('validator/' + mode, n_rows, _validator(mode, rows))
+        for name, func in methods.items():
+            if not getattr(func, 'batch', False) and rows > args.max_per_row_rows:
+                continue
+            record('aggregator/' + name, rows, _aggregator(name, rows))
+        for output_format in ['csv', 'binary']:
+            if output_format == 'csv' and rows > args.max_csv_rows:
+                continue
+            with tempfile.TemporaryDirectory() as data_dir:
+                record('evaluation/' + output_format, rows, _evaluation(Path(data_dir), output_format, rows))
+        for n_modules in args.module_counts:
+            suffix = '/{}_modules'.format(n_modules)
+            for mode in SAMPLE_MODES:
+                n_rows = max(rows // rows_per_sample(mode, n_modules), 1) * rows_per_sample(mode, n_modules)
+                record('generator/' + mode + suffix, n_rows, _generator(mode, rows, n_modules))
+            for name in MODULE_AGNOSTIC:
+                record('aggregator/' + name + suffix, rows, _aggregator(name, rows, n_modules))
+            with tempfile.TemporaryDirectory() as data_dir:
+                record('evaluation/binary' + suffix, rows, _evaluation(Path(data_dir), 'binary', rows, n_modules))
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds=0.0):
+    '''
+    :param min_seconds: benchmarks which took less in the baseline are not compared, their timings are mostly noise
+    :type min_seconds: float
+    :return: benchmarks which are slower or use more memory than the baseline allows
+    :rtype: list
+    '''
+    baseline = {(result['name'], result['rows']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        reference = baseline.get((result['name'], result['rows']))
+        if reference is None or reference['seconds'] < min_seconds:
+            continue
+        speed = result['rows_per_second'] / reference['rows_per_second']
+        memory = result['peak_memory_mb'] / max(reference['peak_memory_mb'], 1e-6)
+        if speed < 1 - threshold or memory > 1 + threshold:
+            regressions.append({'name': result['name'], 'rows': result['rows'], 'speed_ratio': speed,
+                                'memory_ratio': memory})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6, 1e7],
+                        help="rows of each benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs of each benchmark, the median counts")
+    parser.add_argument('--min_seconds', type=float, default=0.5,
+                        help="benchmarks are run again until they have taken this long, for stable fast timings")
+    parser.add_argument('--max_per_row_rows', type=float, default=1e5,
+                        help="largest size for aggregators without batch version")
+    parser.add_argument('--max_csv_rows', type=float, default=1e6, help="largest size for the csv evaluation")
+    parser.add_argument('--module_counts', type=int, nargs='*', default=[10, 50],
+                        help="module counts of the scaling benchmarks besides the 3 modules of the system")
+    parser.add_argument('--output', type=Path, default=Path('benchmark.json'))
+    parser.add_argument('--baseline', type=Path, default=None, help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed relative loss of rows per second and growth of peak memory")
+    parser.add_argument('--gate_min_seconds', type=float, default=0.05,
+                        help="benchmarks faster than this in the baseline are reported but not compared")
+    parser.add_argument('--confirm', type=int, default=2,
+                        help="measurements of a benchmark which looks slower than the baseline before it counts")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes]
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    results = run_benchmarks(args, baseline)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                   'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=4)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.gate_min_seconds)
+        for regression in regressions:
+            print('Regression {name} {rows} rows: speed x{speed_ratio:.2f}, memory x{memory_ratio:.2f}'.format(
+                **regression))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,48 @@
+import argparse
+import sys
+from importlib import import_module
+
+import arguments
+
+'''
+Command line entry point of the pipeline
+
+The subcommands only import their module when they run, so the entry point itself loads nothing but argparse and
+each command loads only its own dependencies, e.g. evaluate never loads the http client and only collect reads the
+endpoint configuration. Everything after the subcommand is passed on to it, `cli.py evaluate --help` shows its
+arguments. The arguments are checked against the parser of the command in arguments.py first, so --help and wrong
+arguments return before numpy and pandas are loaded.
+'''
+
+# subcommand: module, function called with the remaining arguments, parser in arguments.py, help
+COMMANDS = {
+    'generate': ('sample_generator', 'generate', 'generate_parser',
+                 "generate the sample cases, by default of every sample mode"),
+    'evaluate': ('evaluation', 'main', 'evaluate_parser', "evaluate an aggregation function on the cases"),
+    'collect': ('sample_generator', 'collect', 'generate_parser',
+                "request the module responses of the misinfome tweets"),
+    'join': ('collection', 'main', 'join_parser', "join the collected module responses with the gold labels into cases"),
+    'sweep': ('sweep', 'main', 'sweep_parser', "evaluate an aggregation function over a grid of thresholds"),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for name, (_, _, _, description) in COMMANDS.items():
+        commands.add_parser(name, help=description, add_help=False)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv[:1])
+    module, function, parser, _ = COMMANDS[args.command]
+    command_parser = getattr(arguments, parser)()
+    command_parser.prog = 'cli.py ' + args.command
+    command_parser.parse_args(argv[1:])
+    getattr(import_module(module), function)(argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import timing
+from aggregators import LABELS
+from arguments import DATA_DIR, GOLD_FILES, JOIN_CHUNK_SIZE, RESPONSES_FILE, join_parser
+from sample_io import MODULE_COLUMNS, BinaryCaseWriter
+from utils import FAILED_RESPONSE
+
+'''
+Collected module responses as evaluation cases
+
+The module responses of the misinfome tweets (rule-responses/export.csv, written from the response store) are
+joined on tweet id with the gold labels of the label mapping notebook (system_dataset_with5.csv and
+system_dataset_with6.csv). The gold labels are held in a hash index and the responses are streamed in chunks and
+probed against it, so collections larger than memory are joined in one pass. Modules which failed carry the
+FAILED_RESPONSE sentinel, their cred and conf are masked as NaN, which every aggregator treats as a module without
+confidence. The joined rows are written as binary case to the data folder and evaluated like the synthetic cases.
+'''
+
+
+def case_name(gold_file):
+    '''
+    :return: name of the case of a gold label file, e.g. misinfome_with5 for system_dataset_with5.csv
+    :rtype: str
+    '''
+    return 'misinfome_' + Path(gold_file).stem.replace('system_dataset_', '')
+
+
+def read_gold(path):
+    '''
+    Reads the gold labels into a hash index of the tweet ids, labels which are no system label are dropped and of
+    tweet ids with several labels the first one is kept
+    :return: tweet id index, label codes in index order, counts of the dropped rows
+    :rtype: tuple
+    '''
+    gold = pd.read_csv(path, sep='\t', usecols=['normalized_url', 'expected_credible'],
+                       dtype={'normalized_url': str, 'expected_credible': 'category'}).dropna()
+    codes = pd.Categorical(gold['expected_credible'], categories=LABELS).codes.astype(np.int8)
+    known = codes >= 0
+    ids = pd.Index(gold['normalized_url'].to_numpy()[known])
+    codes = codes[known]
+    duplicated = ids.duplicated()
+    first = pd.Series(codes[~duplicated], index=ids[~duplicated])
+    conflicting = int((first.reindex(ids[duplicated]).to_numpy() != codes[duplicated]).sum())
+    counts = {'gold': len(gold), 'unknown_labels': int((~known).sum()), 'duplicated_ids': int(duplicated.sum()),
+              'conflicting_labels': conflicting}
+    return ids[~duplicated], codes[~duplicated], counts
+
+
+def join_chunks(responses_file, index, codes, modules=MODULE_COLUMNS, chunk_size=JOIN_CHUNK_SIZE, counts=None):
+    '''
+    Streams the responses and joins every chunk with the gold labels
+    :param index: tweet ids of the gold labels
+    :type index: pandas.Index
+    :param codes: gold label codes in index order
+    :type codes: numpy.ndarray
+    :param counts: updated with the rows read, joined and masked
+    :type counts: dict
+    :return: chunks with values of shape (rows, modules, 2), failed modules as NaN, and the expected label codes
+    :rtype: generator
+    '''
+    counts = {} if counts is None else counts
+    columns = [module + suffix for module in modules for suffix in ('_cred', '_conf')]
+    joined = np.zeros(len(index), dtype=bool)
+    counts.update({'responses': 0, 'joined': 0, 'failed_modules': dict.fromkeys(modules, 0)})
+    for chunk in pd.read_csv(responses_file, sep='\t', usecols=['#id'] + columns, chunksize=chunk_size,
+                             dtype=dict({'#id': str}, **{column: np.float32 for column in columns})):
+        with timing.stage('join', rows=len(chunk)):
+            position = index.get_indexer(chunk['#id'])
+            matched = position >= 0
+            values = chunk[columns].to_numpy(dtype=np.float32)[matched].reshape(-1, len(modules), 2)
+            failed = (values == FAILED_RESPONSE).any(axis=2)
+            values[failed] = np.nan
+            joined[position[matched]] = True
+        counts['responses'] += len(chunk)
+        counts['joined'] += int(matched.sum())
+        for module, n_failed in zip(modules, failed.sum(axis=0)):
+            counts['failed_modules'][module] += int(n_failed)
+        yield {'values': values, 'expected_credible': codes[position[matched]]}
+    counts['gold_without_response'] = int((~joined).sum())
+
+
+def write_case(responses_file, gold_file, path, chunk_size=JOIN_CHUNK_SIZE):
+    '''
+    Joins the responses with the gold labels of gold_file into the binary case directory path
+    :return: counts of the gold labels, responses, joined rows and failed modules
+    :rtype: dict
+    '''
+    index, codes, counts = read_gold(gold_file)
+    labels = {label: code for code, label in enumerate(LABELS)}
+    with BinaryCaseWriter(path, labels, MODULE_COLUMNS) as writer:
+        for data in join_chunks(responses_file, index, codes, MODULE_COLUMNS, chunk_size, counts):
+            writer.write(data)
+    return counts
+
+
+def write_cases(responses_file=RESPONSES_FILE, gold_files=GOLD_FILES, data_dir=DATA_DIR,
+                chunk_size=JOIN_CHUNK_SIZE):
+    '''
+    Writes one case per gold label file, gold label files which do not exist are skipped
+    :return: {case name: path}
+    :rtype: dict
+    '''
+    cases = {}
+    for gold_file in gold_files:
+        if not Path(gold_file).exists():
+            print('No gold labels {}'.format(gold_file))
+            continue
+        name = case_name(gold_file)
+        counts = write_case(responses_file, gold_file, Path(data_dir) / name, chunk_size)
+        print('{}: {joined} of {responses} responses joined with {gold} gold labels, {gold_without_response} gold '
+              'labels without response'.format(name, **counts))
+        print('failed modules {}'.format(counts['failed_modules']))
+        cases[name] = Path(data_dir) / name
+    return cases
+
+
+def main(argv=None):
+    args = join_parser().parse_args(argv)
+    timing.configure(args.timings, args.profile)
+    cases = write_cases(args.responses, args.gold, args.data_dir, args.chunk_size)
+    if args.aggregate_func:
+        import evaluation
+
+        funcs = evaluation.select_aggregators(args.aggregate_func)
+        for name, path in cases.items():
+            evaluation.evaluate_case(name, path, funcs)
+    timing.dump_profile()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,94 +1,454 @@
 import json
 import os
+import re
+import time
 from pathlib import Path
-import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
 
+import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
-from aggregators import methods
+import timing
+from aggregators import LABELS, MODULES, get_batch, methods
+from arguments import DATA_DIR, SUMMARY_DIR, evaluate_parser
+from metrics import ConfusionMatrix
+from result_cache import ResultCache, case_signature
+from sample_io import case_modules, list_cases, load_case
 
 '''
 Pipeline for the evaluation
 
 '''
 
-DATA_DIR = Path(os.path.dirname(os.path.dirname(__file__))) / Path(os.path.basename(os.path.dirname(__file__))) / 'data'
+# csv column prefix of each module, in the column order of the batch arrays
+COLUMNS = {'misinfome': 'misinfome', 'stance': 'content_analys', 'claim_credibility': 'claim'}
 
+# folder in SUMMARY_DIR with the rows where the aggregators disagree
+DISAGREEMENT_DIR = 'disagreements'
 
-def callback_aggregate(row, aggregate_func='dummy_output'):
-    dummy_request = _create_request(row)
-    response = methods[aggregate_func](dummy_request)
-    return response
 
+def case_columns(path):
+    '''
+    Cases of the three modules of the system are evaluated in the column order of MODULES, cases of other modules
+    in their stored order with the column prefixes as module names
+    :return: csv column prefixes of the modules in column order of the arrays, module names of the aggregators
+    :rtype: tuple
+    '''
+    columns = case_modules(path)
+    standard = [COLUMNS[module] for module in MODULES]
+    if sorted(columns) == sorted(standard):
+        return standard, MODULES
+    return columns, columns
 
-def _create_request(row):
-    return {
 
-        'misinfome': {
-            'cred': row['misinfome_cred'],
-            'conf': row['misinfome_conf']
-        },
-        'stance': {
-            'cred': row['content_analys_cred'],
-            'conf': row['content_analys_conf']
-        },
-        'claim_credibility': {
-            'cred': row['claim_cred'],
-            'conf': row['claim_conf']
-        }
+def evaluate_many(creds, confs, expected, aggregates, chunk_size=1000000, on_disagreement=None):
+    '''
+    Runs every aggregator on each chunk of the shared arrays, the case is read only once for all of them
+    :param aggregates: {name: batch aggregator}
+    :type aggregates: dict
+    :param on_disagreement: called with (row indexes, expected codes, predictions of shape (rows, aggregators)) for
+        the rows of each chunk where the aggregators predict different labels
+    :type on_disagreement: function
+    :return: {name: confusion matrix}
+    :rtype: dict
+    '''
+    matrices = {name: ConfusionMatrix() for name in aggregates}
+    for start in range(0, expected.shape[0], chunk_size):
+        stop = min(start + chunk_size, expected.shape[0])
+        predictions = np.empty((stop - start, len(aggregates)), dtype=np.int8)
+        for j, (name, aggregate) in enumerate(aggregates.items()):
+            with timing.stage('aggregate', rows=stop - start, aggregator=name):
+                predictions[:, j] = aggregate(creds[start:stop], confs[start:stop])
+            with timing.stage('metrics', rows=stop - start, aggregator=name):
+                matrices[name].update(expected[start:stop], predictions[:, j])
+        if on_disagreement is not None and len(aggregates) > 1:
+            rows = np.flatnonzero((predictions != predictions[:, :1]).any(axis=1))
+            on_disagreement(start + rows, expected[start:stop][rows], predictions[rows])
+    return matrices
 
-    }
 
+class DisagreementReport():
+    '''
+    Writes the rows of a case where the aggregators disagree to a csv file, with the row index, the expected label
+    and the label of each aggregator, and counts the disagreements of each pair of aggregators
+    '''
 
-def run(args):
-    target_names = {'credible': 0, 'mostly_credible': 1, 'mostly_not_credible': 2, 'credible_uncertain': 3,
-                    'not_credible': 4,
-                    'not_verifiable': 5}
-    for file_name in DATA_DIR.glob('*.csv'):
-        results = {}
-        name = file_name.name[:-4]
-        results['collection'] = name
-        dummy_values = pd.read_csv(file_name, low_memory=False)
-        print(file_name)
-        ground_labels = [target_names[value] for value in dummy_values.expected_credible]
-        dummy_values['actual_credible'] = dummy_values.apply(lambda row: callback_aggregate(row,args.aggregate_func), axis=1)
-        predictions = [target_names[value] for value in dummy_values.actual_credible]
-        results['accuracy'] = accuracy_score(ground_labels, predictions)
-        scores = precision_recall_fscore_support(ground_labels, predictions, average='macro',
-                                                 labels=list(target_names.values()), zero_division=1)
-        results['precision_macro'] = scores[0]
-        results['recall_macro'] = scores[1]
-        results['fscore_macro'] = scores[2]
-        scores = precision_recall_fscore_support(ground_labels, predictions, average='micro',
-                                                 labels=list(target_names.values()), zero_division=1)
-        results['precision_micro'] = scores[0]
-        results['recall_micro'] = scores[1]
-        results['fscore_micro'] = scores[2]
-        scores = precision_recall_fscore_support(ground_labels, predictions,
-                                                 labels=list(target_names.values()), zero_division=1)
-        # per class precision, recall, f1
-        target_names = list(target_names.keys())
-        for i, score in enumerate(scores):
-            for j in range(len(target_names)):
-                if i == 0:
-                    column_name = 'precision_{}'.format(target_names[j])
-                    results[column_name] = score[j]
-                elif i == 1:
-                    column_name = 'recall_{}'.format(target_names[j])
-                    results[column_name] = score[j]
-                elif i == 2:
-                    column_name = 'fscore_{}'.format(target_names[j])
-                    results[column_name] = score[j]
-        name = name + '.json'
-        with open(DATA_DIR / name, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=4)
+    def __init__(self, names, path=None, max_rows=None):
+        '''
+        :param path: csv file of the rows, None keeps them in memory to be merged into another report
+        :type path: Path
+        :param max_rows: rows written at most, all rows are counted
+        :type max_rows: int
+        '''
+        self.names = list(names)
+        self.path = None if path is None else Path(path)
+        self.max_rows = max_rows
+        self.rows = 0
+        self.pairwise = np.zeros((len(self.names), len(self.names)), dtype=np.int64)
+        self.kept = []
+        if self.path is not None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            pd.DataFrame(columns=['row', 'expected_credible'] + self.names).to_csv(self.path, index=False)
 
+    def __call__(self, rows, expected, predictions):
+        self.pairwise += (predictions[:, :, None] != predictions[:, None, :]).sum(axis=0)
+        self._keep(rows, expected, predictions)
+
+    def _keep(self, rows, expected, predictions):
+        limit = len(rows) if self.max_rows is None else min(max(self.max_rows - self.rows, 0), len(rows))
+        if limit and self.path is None:
+            self.kept.append((rows[:limit], expected[:limit], predictions[:limit]))
+        elif limit:
+            labels = np.asarray(LABELS, dtype=object)
+            chunk = pd.DataFrame(labels[predictions[:limit]], columns=self.names)
+            chunk.insert(0, 'expected_credible', labels[expected[:limit]])
+            chunk.insert(0, 'row', rows[:limit])
+            chunk.to_csv(self.path, mode='a', header=False, index=False)
+        self.rows += len(rows)
+
+    def merge(self, other):
+        '''
+        Adds an in-memory report of the rows which follow the rows of this report, e.g. of the next shard
+        '''
+        self.pairwise += other.pairwise
+        kept = 0
+        for rows, expected, predictions in other.kept:
+            self._keep(rows, expected, predictions)
+            kept += len(rows)
+        self.rows += other.rows - kept
+
+    def summary(self):
+        return {'disagreeing_rows': int(self.rows),
+                'pairwise': {a: {b: int(self.pairwise[i, j]) for j, b in enumerate(self.names) if i != j}
+                             for i, a in enumerate(self.names)}}
+
+
+# arrays of the case shared with the shard workers, attached once per worker
+_shared = {}
+
+
+def _share(arrays):
+    '''
+    Copies arrays into shared memory
+    :param arrays: {key: array}
+    :type arrays: dict
+    :return: shared memory blocks, {key: (block name, shape, dtype)} to attach them
+    :rtype: tuple
+    '''
+    blocks = []
+    descriptors = {}
+    for key, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        blocks.append(block)
+        np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf), array)
+        descriptors[key] = (block.name, array.shape, array.dtype.str)
+    return blocks, descriptors
+
+
+def _attach(settings, descriptors):
+    '''
+    Initializer of the shard workers, the arrays are views of the shared memory without a copy
+    '''
+    timing.configure(*settings)
+    for key, (name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=name)
+        _shared[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def _evaluate_shard(funcs, modules, start, stop, chunk_size, max_disagreements):
+    '''
+    :return: {aggregator: confusion matrix array} of the rows start to stop, in-memory disagreement report or None
+    :rtype: tuple
+    '''
+    creds, confs, expected = (_shared[key][1][start:stop] for key in ('creds', 'confs', 'expected'))
+    report = DisagreementReport(funcs, None, max_disagreements) if len(funcs) > 1 else None
+
+    def on_disagreement(rows, expected_codes, predictions):
+        report(start + rows, expected_codes, predictions)
+
+    matrices = evaluate_many(creds, confs, expected, {func: get_batch(func, modules) for func in funcs}, chunk_size,
+                             None if report is None else on_disagreement)
+    return {func: matrix.matrix for func, matrix in matrices.items()}, report
+
+
+def evaluate_sharded(creds, confs, expected, funcs, modules, shards, chunk_size=1000000, report=None):
+    '''
+    Evaluates one case in shards processes. The arrays are copied once into shared memory, every worker attaches to
+    them and evaluates ranges of chunk_size rows, only the confusion matrices and the disagreements of each range
+    are sent back and summed.
+    :param funcs: names of the aggregators
+    :type funcs: list
+    :param report: report of the disagreements, the rows are the same as in the sequential evaluation
+    :type report: DisagreementReport
+    :return: {name: confusion matrix}
+    :rtype: dict
+    '''
+    n_rows = expected.shape[0]
+    with timing.stage('share', rows=n_rows):
+        blocks, descriptors = _share({'creds': creds, 'confs': confs, 'expected': expected})
+    try:
+        starts = list(range(0, n_rows, chunk_size))
+        stops = [min(start + chunk_size, n_rows) for start in starts]
+        matrices = {func: ConfusionMatrix() for func in funcs}
+        with ProcessPoolExecutor(max_workers=shards, initializer=_attach,
+                                 initargs=(timing.settings(), descriptors)) as executor:
+            for partial, shard_report in executor.map(_evaluate_shard, repeat(funcs), repeat(modules), starts, stops,
+                                                      repeat(chunk_size),
+                                                      repeat(None if report is None else report.max_rows)):
+                for func, matrix in partial.items():
+                    matrices[func].matrix += matrix
+                if report is not None:
+                    report.merge(shard_report)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return matrices
+
+
+def evaluate_case(name, file_name, aggregate_funcs, chunk_size=1000000, bootstrap=0, confidence=0.95,
+                  max_disagreements=None, shards=1):
+    '''
+    Evaluates one case with every aggregator and writes the results next to it as {aggregator: results}, results of
+    other aggregators in an existing file are kept. With more than one aggregator the rows where they disagree are
+    written to summary/disagreements/{name}.csv.
+    :param aggregate_funcs: names of the aggregators
+    :type aggregate_funcs: list
+    :param bootstrap: replicates of the bootstrap confidence intervals, 0 for none
+    :type bootstrap: int
+    :param max_disagreements: rows of the disagreement report, all if None
+    :type max_disagreements: int
+    :param shards: processes evaluating the rows of the case, cases of at most chunk_size rows are evaluated here
+    :type shards: int
+    :return: {aggregator: results of the case}, aggregators which do not support the modules of the case, e.g.
+        policies without rules for them, get {'collection': name, 'skipped': reason}
+    :rtype: dict
+    '''
+    target_names = {label: code for code, label in enumerate(LABELS)}
+    columns, modules = case_columns(file_name)
+    print(file_name)
+    creds, confs, ground_labels = load_case(file_name, columns, target_names)
+    aggregates = {}
+    skipped = {}
+    for func in aggregate_funcs:
+        try:
+            aggregates[func] = get_batch(func, modules)
+        except ValueError as error:
+            # e.g. policies without rules for the modules of the case, the other aggregators still run
+            print('Skipped {} on {}: {}'.format(func, name, error))
+            skipped[func] = {'collection': name, 'skipped': str(error)}
+    funcs = list(aggregates)
+    report = None
+    if len(funcs) > 1:
+        report = DisagreementReport(funcs, Path(file_name).parent / SUMMARY_DIR / DISAGREEMENT_DIR /
+                                    (name + '.csv'), max_disagreements)
+    if shards > 1 and ground_labels.shape[0] > chunk_size:
+        matrices = evaluate_sharded(creds, confs, ground_labels, funcs, modules, shards, chunk_size, report)
+    else:
+        matrices = evaluate_many(creds, confs, ground_labels, aggregates, chunk_size, report)
+    all_results = {}
+    for func in aggregate_funcs:
+        if func in skipped:
+            all_results[func] = skipped[func]
+            continue
+        results = {'collection': name}
+        with timing.stage('bootstrap', rows=bootstrap, aggregator=func):
+            results.update(matrices[func].results(bootstrap, confidence))
+        all_results[func] = results
+    write_case_results(name, file_name, all_results, report)
+    return all_results
+
+
+def write_case_results(name, file_name, all_results, report=None):
+    '''
+    Writes the results of a case next to it as {aggregator: results} with the signature of the case files in
+    '_signature', results of other aggregators in an existing file are kept while the case did not change
+    '''
+    with timing.stage('write_json', case=name):
+        path = Path(file_name).parent / (name + '.json')
+        signature = [list(entry) for entry in case_signature(file_name)]
+        stored = {}
+        if path.exists():
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+        # results of an earlier version of the case are stale, as well as files of single results written before
+        # the results were keyed by aggregator
+        if stored.get('_signature') != signature:
+            stored = {}
+        stored = {func: results for func, results in stored.items() if isinstance(results, dict)}
+        stored.update(all_results)
+        stored['_signature'] = signature
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(stored, f, ensure_ascii=False, indent=4)
+        if report is not None:
+            with open(report.path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+                json.dump(report.summary(), f, ensure_ascii=False, indent=4)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--aggregate_func', type=str, default='default',
-                        help="Select aggregate function e.g sum, max, etc")
 
-    args = parser.parse_args()
+def summary_name(aggregate_func):
+    '''
+    :return: file name of the results of an aggregator, paths of policy files and lookup tables with their separators
+        replaced, e.g. policies_majority_vote.json for policies/majority_vote.json
+    :rtype: str
+    '''
+    return re.sub(r'[^\w.-]+', '_', str(aggregate_func)).strip('_')
+
+
+def write_summary(all_results, aggregate_func, data_dir=DATA_DIR):
+    '''
+    Writes the results of all cases as one table to summary/{summary name}.json and .csv, every row names the
+    aggregator
+    '''
+    summary_dir = data_dir / SUMMARY_DIR
+    os.makedirs(summary_dir, exist_ok=True)
+    all_results = [dict(results, aggregator=aggregate_func) for results in all_results]
+    name = summary_name(aggregate_func)
+    with open(summary_dir / (name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(all_results, f, ensure_ascii=False, indent=4)
+    pd.DataFrame(all_results).set_index('collection').to_csv(summary_dir / (name + '.csv'))
+
+
+def select_aggregators(names):
+    '''
+    :param names: names of aggregators in evaluation order, all expands to every registered aggregator, lookup
+        tables or policy files given with it are kept
+    :type names: list
+    :rtype: list
+    '''
+    expanded = [method for name in names for method in (methods if name == 'all' else [name])]
+    # unknown names fail before any case is evaluated
+    unknown = [name for name in expanded if name not in methods and not Path(name).is_file()]
+    if unknown:
+        raise ValueError('Unknown aggregators {}, select registered ones {} or paths of policy files or lookup '
+                         'tables'.format(unknown, list(methods)))
+    return list(dict.fromkeys(expanded))
+
+
+def evaluate_cases(cases, funcs, args, cache=None):
+    '''
+    Evaluates the cases with every aggregator, cases with cached results of all aggregators are not read. A case
+    with a missing result is evaluated with all aggregators since its disagreement report needs every prediction.
+    :param cases: {case name: path}
+    :type cases: dict
+    :param cache: cache of the results, None evaluates every case
+    :type cache: ResultCache
+    :return: {case name: {aggregator: results}}
+    :rtype: dict
+    '''
+    all_results = {}
+    keys = {}
+    for name, file_name in cases.items():
+        if cache is None:
+            continue
+        digest = cache.case_digest(file_name)
+        keys[name] = {func: cache.key(digest, func, bootstrap=args.bootstrap, confidence=args.confidence)
+                      for func in funcs}
+        cached = {func: cache.get(key) for func, key in keys[name].items()}
+        if all(results is not None for results in cached.values()):
+            all_results[name] = {func: dict(results, collection=name) for func, results in cached.items()}
+            write_case_results(name, file_name, all_results[name])
+    todo = {name: file_name for name, file_name in cases.items() if name not in all_results}
+    # cases are evaluated one after another when the rows of each case are sharded over the processes
+    if args.workers > 1 and len(todo) > 1 and args.shards <= 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=timing.configure,
+                                 initargs=timing.settings()) as executor:
+            evaluated = list(executor.map(evaluate_case, todo.keys(), todo.values(), repeat(funcs),
+                                          repeat(args.chunk_size), repeat(args.bootstrap),
+                                          repeat(args.confidence), repeat(args.max_disagreements)))
+    else:
+        evaluated = [evaluate_case(name, file_name, funcs, args.chunk_size, args.bootstrap, args.confidence,
+                                   args.max_disagreements, args.shards) for name, file_name in todo.items()]
+    for name, results in zip(todo, evaluated):
+        all_results[name] = results
+        if cache is not None:
+            for func in funcs:
+                cache.put(keys[name][func], name, func, results[func])
+    return {name: all_results[name] for name in cases}
+
+
+def write_summaries(all_results, funcs, data_dir=DATA_DIR):
+    '''
+    Writes the summary of each aggregator over the cases it evaluated, cases it skipped are left out
+    '''
+    for func in funcs:
+        rows = [results[func] for results in all_results.values() if 'skipped' not in results[func]]
+        if rows:
+            write_summary(rows, func, data_dir)
+
+
+def _signatures(cases):
+    signatures = {}
+    for name, path in cases.items():
+        try:
+            signatures[name] = case_signature(path)
+        except OSError:
+            # removed while listing
+            signatures[name] = None
+    return signatures
+
+
+def watch(args, funcs, cache=None):
+    '''
+    Evaluates all cases, then polls data_dir every watch_interval seconds and evaluates the new and changed cases.
+    A case is evaluated once its files did not change for one interval, so cases which are still being written are
+    not read.
+    '''
+    cases = list_cases(args.data_dir)
+    polled = _signatures(cases)
+    all_results = evaluate_cases(cases, funcs, args, cache)
+    write_summaries(all_results, funcs, args.data_dir)
+    evaluated = dict(polled)
+    print('Watching {} for changed cases'.format(args.data_dir))
+    while True:
+        time.sleep(args.watch_interval)
+        cases = list_cases(args.data_dir)
+        current = _signatures(cases)
+        changed = {name: path for name, path in cases.items()
+                   if current[name] is not None and current[name] != evaluated.get(name) and
+                   current[name] == polled.get(name)}
+        removed = [name for name in all_results if name not in cases]
+        polled = current
+        if not changed and not removed:
+            continue
+        for name in removed:
+            del all_results[name]
+            del evaluated[name]
+        all_results.update(evaluate_cases(changed, funcs, args, cache))
+        evaluated.update({name: current[name] for name in changed})
+        all_results = dict(sorted(all_results.items()))
+        write_summaries(all_results, funcs, args.data_dir)
+        print('Evaluated {} changed cases, removed {}'.format(len(changed), len(removed)))
+
+
+def run(args):
+    funcs = select_aggregators(args.aggregate_func)
+    cache = ResultCache(args.cache, int(args.cache_size * 2 ** 20)) if args.cache else None
+    try:
+        if args.watch:
+            watch(args, funcs, cache)
+        else:
+            write_summaries(evaluate_cases(list_cases(args.data_dir), funcs, args, cache), funcs, args.data_dir)
+    except KeyboardInterrupt:
+        if not args.watch:
+            raise
+    finally:
+        if cache is not None:
+            print('Result cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+            cache.close()
+
+
+def main(argv=None):
+    args = evaluate_parser().parse_args(argv)
+    timing.configure(args.timings, args.profile)
+    if args.profile:
+        # the profiler only sees the stages of this process
+        args.workers = 1
+        args.shards = 1
     run(args)
+    timing.dump_profile()
+
+
+if __name__ == '__main__':
+    main()
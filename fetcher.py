@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+import timing
+from utils import parse_id, parse_module_responses
+
+'''
+Asynchronous tweet fetcher for the policy manager
+
+All queries share one connection pool. Tweets are submitted with a limited number of requests in flight and
+one scheduler polls every outstanding query_id when it is due, the polling interval of a query grows while it is
+in progress until its deadline.
+'''
+
+QUERY_PATH = '/twitter/tweet'
+RESPONSE_PATH = '/response/{query_id}/debug'
+
+IN_PROGRESS = ('in_progress', 'partly_done')
+
+
+class _Query():
+    __slots__ = ('url', 'deadline', 'next_poll', 'interval', 'last_response')
+
+    def __init__(self, url, now, poll_interval, query_timeout):
+        self.url = url
+        self.deadline = now + query_timeout
+        self.next_poll = now + poll_interval
+        self.interval = poll_interval
+        self.last_response = None
+
+
+def _tweet_args(tweet_url):
+    return {
+        "tweet_id": parse_id(tweet_url),
+        "tweet_author": "string",
+        "tweet_text": "string"
+    }
+
+
+async def _get_json(session, method, url, **kwargs):
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            return await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+
+async def fetch_tweets(tweet_urls, endpoint, concurrency=16, max_outstanding=None, poll_interval=0.25,
+                       max_poll_interval=5.0, backoff=1.5, query_timeout=120.0, on_result=None, rate=None,
+                       observer=None):
+    '''
+    Requests the module responses of the tweets from the policy manager
+    :param tweet_urls: tweet urls
+    :type tweet_urls: iterable
+    :param endpoint: policy manager endpoint
+    :type endpoint: str
+    :param concurrency: maximum number of http requests in flight, also the size of the connection pool
+    :type concurrency: int
+    :param max_outstanding: maximum number of submitted queries which are not done yet, default 4 * concurrency
+    :type max_outstanding: int
+    :param poll_interval: first polling interval of a query in seconds
+    :type poll_interval: float
+    :param max_poll_interval: upper limit of the polling interval in seconds
+    :type max_poll_interval: float
+    :param backoff: factor of the polling interval after each poll of an unfinished query
+    :type backoff: float
+    :param query_timeout: seconds after submission when the last response of a query is taken as done
+    :type query_timeout: float
+    :param on_result: called with (url, response) when a tweet is finished
+    :type on_result: function
+    :param rate: tweets submitted per second, by default as fast as the limits allow
+    :type rate: float
+    :param observer: called with (event, url, raw response) for the events submitted, polled, done and failed
+    :type observer: function
+    :return: {url: module responses or None if the query failed}
+    :rtype: dict
+    '''
+    loop = asyncio.get_running_loop()
+    requests_limit = asyncio.Semaphore(concurrency)
+    outstanding = asyncio.Semaphore(max_outstanding or 4 * concurrency)
+    pending = {}
+    wakeup = asyncio.Event()
+    results = {}
+    # summed seconds and count of the submit and poll requests and the parsing of the responses
+    stages = {name: [0.0, 0] for name in ('submit', 'poll', 'parse')}
+
+    start = loop.time()
+
+    def timed(name, begin):
+        stages[name][0] += time.perf_counter() - begin
+        stages[name][1] += 1
+
+    def notify(event, url, response):
+        if observer is not None:
+            observer(event, url, response)
+
+    def finish(url, response):
+        results[url] = response
+        if on_result is not None:
+            on_result(url, response)
+
+    async def submit(session, url, index):
+        if rate:
+            await asyncio.sleep(max(start + index / rate - loop.time(), 0))
+        await outstanding.acquire()
+        async with requests_limit:
+            begin = time.perf_counter()
+            response = await _get_json(session, 'POST', endpoint + QUERY_PATH, json=_tweet_args(url))
+            timed('submit', begin)
+        if not response or 'query_id' not in response:
+            outstanding.release()
+            notify('failed', url, response)
+            finish(url, None)
+            return
+        notify('submitted', url, response)
+        pending[response['query_id']] = _Query(url, loop.time(), poll_interval, query_timeout)
+        wakeup.set()
+
+    async def poll(session, query_id, query):
+        async with requests_limit:
+            begin = time.perf_counter()
+            response = await _get_json(session, 'GET', endpoint + RESPONSE_PATH.format(query_id=query_id))
+            timed('poll', begin)
+        now = loop.time()
+        notify('polled', query.url, response)
+        in_progress = response is None or response.get('status') in IN_PROGRESS
+        if in_progress and now < query.deadline:
+            query.last_response = response or query.last_response
+            query.interval = min(query.interval * backoff, max_poll_interval)
+            query.next_poll = min(now + query.interval, query.deadline)
+            return
+        del pending[query_id]
+        outstanding.release()
+        response = response or query.last_response
+        notify('done', query.url, response)
+        begin = time.perf_counter()
+        parsed = parse_module_responses(response) if response else None
+        timed('parse', begin)
+        finish(query.url, parsed)
+
+    async def schedule(session, submitting):
+        while pending or not submitting.done():
+            now = loop.time()
+            due = [(query_id, query) for query_id, query in pending.items() if query.next_poll <= now]
+            if due:
+                await asyncio.gather(*(poll(session, query_id, query) for query_id, query in due))
+                continue
+            next_poll = min((query.next_poll for query in pending.values()), default=now + poll_interval)
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=max(next_poll - now, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        submitting = asyncio.ensure_future(asyncio.gather(*(submit(session, url, index)
+                                                            for index, url in enumerate(tweet_urls))))
+        with timing.stage('fetch') as info:
+            await schedule(session, submitting)
+            await submitting
+            info['rows'] = len(results)
+    for name, (seconds, count) in stages.items():
+        timing.record(name, seconds, rows=count)
+    return results
+
+
+def fetch(tweet_urls, endpoint, **kwargs):
+    '''
+    Blocking version of fetch_tweets
+    '''
+    return asyncio.run(fetch_tweets(tweet_urls, endpoint, **kwargs))
+
+
+async def _throughput(args):
+    import stub_server
+
+    runner, endpoint = await stub_server.start(delay=args.delay, jitter=args.jitter)
+    urls = ['https://twitter.com/stub/status/{}'.format(i) for i in range(args.n_tweets)]
+    try:
+        start = time.perf_counter()
+        results = await fetch_tweets(urls, endpoint, concurrency=args.concurrency,
+                                     max_outstanding=args.max_outstanding, query_timeout=args.query_timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    failed = sum(response is None for response in results.values())
+    print('Fetched {} tweets in {:.2f}s ({:.1f} tweets/s), {} failed'.format(len(results), elapsed,
+                                                                             len(results) / elapsed, failed))
+
+
+if __name__ == '__main__':
+    print('This script measures the throughput of the fetcher against the local stub server')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_tweets', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max_outstanding', type=int, default=None)
+    parser.add_argument('--query_timeout', type=float, default=120.0)
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds until the stub finishes a query")
+    parser.add_argument('--jitter', type=float, default=0.5, help="random seconds added to the stub delay")
+    timing.add_arguments(parser, 'fetch')
+    args = parser.parse_args()
+    timing.configure(args.timings, args.profile)
+    asyncio.run(_throughput(args))
+    timing.dump_profile()
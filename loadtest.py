@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from arguments import DATA_DIR, ENV_FILE
+from fetcher import fetch_tweets
+from utils import parse_id
+
+'''
+Load test of the policy manager endpoint
+
+Replays tweet urls of the misinfome tsv files either open loop at a target rate of submitted tweets per second or
+closed loop with a fixed number of outstanding queries. Every query records its submit to done latency, the status
+transitions seen while polling and the module response codes of the final response. The latency percentiles, the
+transition and response code counts and the latency histogram are written to the output folder.
+'''
+
+STATUSES = ['in_progress', 'partly_done', 'done']
+PERCENTILES = [50, 95, 99]
+
+
+class _Trace():
+    __slots__ = ('submitted', 'done', 'statuses', 'response_codes')
+
+    def __init__(self):
+        self.submitted = None
+        self.done = None
+        self.statuses = []
+        self.response_codes = {}
+
+
+def read_urls(paths, n_requests=None):
+    '''
+    Reads the tweet urls of misinfome tsv files, urls are repeated with a replay suffix until n_requests are reached
+    :param paths: tsv files with an url column
+    :type paths: list
+    :param n_requests: number of urls, default every tweet url once
+    :type n_requests: int
+    :return: tweet urls
+    :rtype: list
+    '''
+    urls = pd.concat([pd.read_csv(path, sep='\t', usecols=['url'])['url'] for path in paths])
+    urls = [url for url in pd.unique(urls.dropna()) if parse_id(url) is not None]
+    if not urls:
+        raise ValueError('No tweet urls in {}'.format([str(path) for path in paths]))
+    n_requests = n_requests or len(urls)
+    return [url if i < len(urls) else '{}?replay={}'.format(url, i // len(urls))
+            for i, url in zip(range(n_requests), _cycle(urls))]
+
+
+def _cycle(urls):
+    while True:
+        yield from urls
+
+
+def stub_urls(n_requests):
+    return ['https://twitter.com/stub/status/{}'.format(i) for i in range(n_requests)]
+
+
+async def load_test(urls, endpoint, rate=None, concurrency=None, connections=64, poll_interval=0.1,
+                    query_timeout=120.0):
+    '''
+    Submits the urls to the endpoint and traces every query
+    :param rate: tweets submitted per second, open loop
+    :type rate: float
+    :param concurrency: outstanding queries, closed loop
+    :type concurrency: int
+    :param connections: http requests in flight
+    :type connections: int
+    :param poll_interval: fixed polling interval in seconds, the resolution of the latencies
+    :type poll_interval: float
+    :return: {url: trace}, seconds of the whole run
+    :rtype: tuple
+    '''
+    traces = defaultdict(_Trace)
+
+    def observer(event, url, response):
+        now = time.perf_counter()
+        trace = traces[url]
+        if event == 'submitted':
+            trace.submitted = now
+            return
+        status = (response or {}).get('status')
+        if event == 'polled' and status and (not trace.statuses or trace.statuses[-1] != status):
+            trace.statuses.append(status)
+        elif event == 'done':
+            trace.done = now
+            trace.response_codes = (response or {}).get('module_response_code', {})
+
+    start = time.perf_counter()
+    await fetch_tweets(urls, endpoint, concurrency=connections,
+                       max_outstanding=len(urls) if rate else concurrency, poll_interval=poll_interval,
+                       max_poll_interval=poll_interval, backoff=1.0, query_timeout=query_timeout, rate=rate,
+                       observer=observer)
+    return traces, time.perf_counter() - start
+
+
+def summarize(traces, seconds, bins=50):
+    '''
+    :return: summary and latency histogram
+    :rtype: tuple
+    '''
+    latencies = np.asarray([trace.done - trace.submitted for trace in traces.values()
+                            if trace.done is not None and trace.statuses[-1:] == ['done']])
+    transitions = Counter(' -> '.join(trace.statuses) for trace in traces.values() if trace.statuses)
+    response_codes = defaultdict(Counter)
+    for trace in traces.values():
+        for module, code in trace.response_codes.items():
+            response_codes[module][str(code)] += 1
+
+    summary = {'requests': len(traces), 'done': len(latencies), 'failed': len(traces) - len(latencies),
+               'seconds': seconds, 'throughput': len(latencies) / seconds,
+               'transitions': dict(transitions),
+               'status_counts': {status: sum(status in trace.statuses for trace in traces.values())
+                                 for status in STATUSES},
+               'module_response_codes': {module: dict(codes) for module, codes in sorted(response_codes.items())}}
+    if len(latencies):
+        summary.update({'latency_p{}'.format(p): value
+                        for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))})
+        summary.update({'latency_mean': latencies.mean(), 'latency_max': latencies.max()})
+        counts, edges = np.histogram(latencies, bins=bins)
+    else:
+        counts, edges = np.zeros(0, dtype=int), np.zeros(1)
+    histogram = pd.DataFrame({'latency_from': edges[:-1], 'latency_to': edges[1:], 'count': counts})
+    return summary, histogram
+
+
+def write_results(summary, histogram, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(output_dir / 'summary.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+    histogram.to_csv(output_dir / 'latency_histogram.csv', index=False)
+    rows = [{'module': module, 'response_code': code, 'count': count}
+            for module, codes in summary['module_response_codes'].items() for code, count in codes.items()]
+    pd.DataFrame(rows, columns=['module', 'response_code', 'count']).to_csv(
+        output_dir / 'module_response_codes.csv', index=False)
+
+
+async def run(args):
+    runner = None
+    endpoint = args.endpoint
+    if args.stub:
+        import stub_server
+
+        runner, endpoint = await stub_server.start(delay=args.delay, jitter=args.jitter,
+                                                   failure_rate=args.failure_rate)
+    try:
+        urls = stub_urls(args.n_requests or 1000) if args.stub and not args.tsv else \
+            read_urls(args.tsv or [DATA_DIR / 'misinfome' / 'joined_tables.tsv'], args.n_requests)
+        traces, seconds = await load_test(urls, endpoint, rate=args.rate, concurrency=args.concurrency,
+                                          connections=args.connections, poll_interval=args.poll_interval,
+                                          query_timeout=args.query_timeout)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    summary, histogram = summarize(traces, seconds, bins=args.bins)
+    write_results(summary, histogram, args.output_dir)
+    print('{requests} requests, {done} done, {failed} failed in {seconds:.2f}s ({throughput:.1f} tweets/s)'.format(
+        **summary))
+    if summary['done']:
+        print('latency p50 {latency_p50:.3f}s p95 {latency_p95:.3f}s p99 {latency_p99:.3f}s'.format(**summary))
+
+
+if __name__ == '__main__':
+    load_dotenv(dotenv_path=ENV_FILE)
+    parser = argparse.ArgumentParser()
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument('--rate', type=float, help="tweets submitted per second (open loop)")
+    load.add_argument('--concurrency', type=int, help="outstanding queries (closed loop)")
+    parser.add_argument('--tsv', type=str, nargs='+', default=None,
+                        help="misinfome tsv files with tweet urls, default data/misinfome/joined_tables.tsv")
+    parser.add_argument('--n_requests', type=int, default=None, help="tweets to submit, urls are replayed")
+    parser.add_argument('--endpoint', type=str, default=os.getenv('COINFORM_ENDPOINT', ''))
+    parser.add_argument('--connections', type=int, default=64, help="http requests in flight")
+    parser.add_argument('--poll_interval', type=float, default=0.1, help="seconds between polls of a query")
+    parser.add_argument('--query_timeout', type=float, default=120.0)
+    parser.add_argument('--bins', type=int, default=50, help="bins of the latency histogram")
+    parser.add_argument('--output_dir', type=lambda path: DATA_DIR / 'loadtest' / path, default='latest',
+                        help="folder in data/loadtest for the results")
+    parser.add_argument('--stub', action='store_true', help="run against a local stub of the policy manager")
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds until the stub finishes a query")
+    parser.add_argument('--jitter', type=float, default=0.5, help="random seconds added to the stub delay")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="probability of a failed stub module")
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,146 @@
+import argparse
+import json
+
+import numpy as np
+
+'''
+Lookup-table aggregators
+
+An aggregator is sampled once on a grid of cred_steps credibilities in [-1, 1] and conf_steps confidences in [0, 1]
+for each module. The labels are stored as int8 array with the axes (cred, conf) of each module in column order, e.g.
+shape (21, 11, 21, 11, 21, 11) for 3 modules. Queries round each input to the nearest grid point and look the label
+up with one flat index, so an expensive per-row policy costs a vectorized index lookup. Tables are saved as .npy
+and can be loaded memory-mapped.
+
+The table only approximates the aggregator near its boundaries, verify reports how often it disagrees with the exact
+function on random samples.
+'''
+
+# grid rows sampled at a time
+TABULATE_CHUNK_SIZE = 1000000
+
+
+def _grid_axes(cred_steps, conf_steps, n_modules):
+    return (cred_steps, conf_steps) * n_modules
+
+
+class LookupTable():
+    batch = True
+
+    def __init__(self, table):
+        '''
+        :param table: labels of shape (cred_steps, conf_steps) * n_modules
+        :type table: numpy.ndarray
+        '''
+        if table.ndim % 2 or table.ndim == 0 or len(set(table.shape[0::2])) != 1 or len(set(table.shape[1::2])) != 1:
+            raise ValueError('Lookup table has no (cred, conf) grid of each module, got shape {}'.format(table.shape))
+        self.table = table
+        self.cred_steps = table.shape[0]
+        self.conf_steps = table.shape[1]
+        self.n_modules = table.ndim // 2
+        self._flat = table.reshape(-1)
+        self._strides = np.asarray([int(np.prod(table.shape[axis + 1:])) for axis in range(table.ndim)],
+                                   dtype=np.int64)
+
+    @classmethod
+    def from_aggregator(cls, aggregate, cred_steps=21, conf_steps=11, n_modules=3):
+        '''
+        Samples a batch aggregator on every grid point
+        :param aggregate: batch aggregator
+        :type aggregate: function
+        :return: lookup table
+        :rtype: LookupTable
+        '''
+        shape = _grid_axes(cred_steps, conf_steps, n_modules)
+        cred_values = np.linspace(-1, 1, cred_steps)
+        conf_values = np.linspace(0, 1, conf_steps)
+        flat = np.empty(int(np.prod(shape)), dtype=np.int8)
+        for start in range(0, flat.shape[0], TABULATE_CHUNK_SIZE):
+            stop = min(start + TABULATE_CHUNK_SIZE, flat.shape[0])
+            index = np.unravel_index(np.arange(start, stop), shape)
+            creds = np.column_stack([cred_values[index[2 * j]] for j in range(n_modules)])
+            confs = np.column_stack([conf_values[index[2 * j + 1]] for j in range(n_modules)])
+            flat[start:stop] = aggregate(creds, confs)
+        return cls(flat.reshape(shape))
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        '''
+        :param mmap: memory-map the table instead of reading it
+        :type mmap: bool
+        '''
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    def _index(self, values, low, high, steps):
+        position = (np.nan_to_num(values, nan=low) - low) / (high - low) * (steps - 1)
+        return np.clip(np.rint(position), 0, steps - 1).astype(np.int64)
+
+    def __call__(self, creds, confs):
+        '''
+        Batch aggregator, inputs outside of the grid are clipped to it and NaN counts as the lowest grid value
+        :return: label codes
+        :rtype: numpy.ndarray
+        '''
+        if creds.shape[1] != self.n_modules:
+            raise ValueError('Lookup table of {} modules got {} modules'.format(self.n_modules, creds.shape[1]))
+        flat = np.zeros(creds.shape[0], dtype=np.int64)
+        for j in range(self.n_modules):
+            flat += self._index(creds[:, j], -1, 1, self.cred_steps) * self._strides[2 * j]
+            flat += self._index(confs[:, j], 0, 1, self.conf_steps) * self._strides[2 * j + 1]
+        return self._flat[flat]
+
+    def verify(self, aggregate, n_samples=1000000, seed=42, chunk_size=1000000):
+        '''
+        Compares the table with the exact aggregator on uniform random samples of the input range
+        :return: samples, disagreements, disagreement rate and the disagreements of each exact label code
+        :rtype: dict
+        '''
+        rng = np.random.default_rng(seed)
+        disagreements = 0
+        per_label = {}
+        for start in range(0, n_samples, chunk_size):
+            size = min(chunk_size, n_samples - start)
+            creds = rng.uniform(-1, 1, size=(size, self.n_modules))
+            confs = rng.uniform(0, 1, size=(size, self.n_modules))
+            exact = aggregate(creds, confs)
+            differ = self(creds, confs) != exact
+            disagreements += int(differ.sum())
+            for code, count in zip(*np.unique(exact[differ], return_counts=True)):
+                per_label[int(code)] = per_label.get(int(code), 0) + int(count)
+        return {'samples': n_samples, 'disagreements': disagreements, 'rate': disagreements / max(n_samples, 1),
+                'per_label': per_label, 'table_bytes': int(self.table.nbytes)}
+
+
+def main(argv=None):
+    from aggregators import LABELS, MODULES, get_batch
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aggregate_func', type=str, required=True,
+                        help="aggregator to tabulate and to verify the table against")
+    parser.add_argument('--table', type=str, required=True, help=".npy file of the table")
+    parser.add_argument('--cred_steps', type=int, default=21, help="grid points of the credibility of each module")
+    parser.add_argument('--conf_steps', type=int, default=11, help="grid points of the confidence of each module")
+    parser.add_argument('--verify', type=int, default=0, help="random samples to compare the table with the function")
+    parser.add_argument('--verify_only', action='store_true', help="verify an existing table without tabulating")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    aggregate = get_batch(args.aggregate_func)
+    if args.verify_only:
+        table = LookupTable.load(args.table, mmap=True)
+    else:
+        size = int(np.prod(_grid_axes(args.cred_steps, args.conf_steps, len(MODULES))))
+        print('Tabulating {} on {} grid points ({:.1f} MB)'.format(args.aggregate_func, size, size / 2 ** 20))
+        table = LookupTable.from_aggregator(aggregate, args.cred_steps, args.conf_steps, len(MODULES))
+        table.save(args.table)
+    if args.verify or args.verify_only:
+        report = table.verify(aggregate, args.verify or 1000000, args.seed)
+        report['per_label'] = {LABELS[code]: count for code, count in report['per_label'].items()}
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import numpy as np
+
+from aggregators import LABELS
+
+'''
+Evaluation metrics derived from one confusion matrix
+
+Scores follow sklearn's precision_recall_fscore_support with zero_division=1. All functions accept stacks of
+confusion matrices with shape (..., n_labels, n_labels), rows are expected labels and columns predictions.
+'''
+
+
+def confusion_matrix(expected, predictions, n_labels=len(LABELS)):
+    '''
+    :param expected: expected label codes
+    :type expected: numpy.ndarray
+    :param predictions: predicted label codes
+    :type predictions: numpy.ndarray
+    :return: counts of shape (n_labels, n_labels)
+    :rtype: numpy.ndarray
+    '''
+    cells = np.asarray(expected, dtype=np.int64) * n_labels + np.asarray(predictions, dtype=np.int64)
+    return np.bincount(cells, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+
+
+def _divide(numerator, denominator):
+    # zero_division=1
+    return np.where(denominator > 0, numerator / np.maximum(denominator, 1), 1.0)
+
+
+def scores(matrix):
+    '''
+    :param matrix: confusion matrices of shape (..., n_labels, n_labels)
+    :type matrix: numpy.ndarray
+    :return: {metric: array of shape (...) or (..., n_labels) for per class metrics}
+    :rtype: dict
+    '''
+    matrix = np.asarray(matrix)
+    true_positives = np.diagonal(matrix, axis1=-2, axis2=-1)
+    expected = matrix.sum(axis=-1)
+    predicted = matrix.sum(axis=-2)
+    total = expected.sum(axis=-1)
+
+    precision = _divide(true_positives, predicted)
+    recall = _divide(true_positives, expected)
+    fscore = _divide(2 * true_positives, expected + predicted)
+    micro = _divide(true_positives.sum(axis=-1), total)
+    return {
+        'accuracy': _divide(true_positives.sum(axis=-1), total),
+        'precision_macro': precision.mean(axis=-1),
+        'recall_macro': recall.mean(axis=-1),
+        'fscore_macro': fscore.mean(axis=-1),
+        'precision_micro': micro,
+        'recall_micro': micro,
+        'fscore_micro': micro,
+        'precision': precision,
+        'recall': recall,
+        'fscore': fscore,
+    }
+
+
+def to_results(metrics, labels=LABELS):
+    '''
+    Flattens the metrics of one confusion matrix into the result schema of the evaluation
+    '''
+    results = {}
+    for name, values in metrics.items():
+        if np.ndim(values) == 0:
+            results[name] = float(values)
+    for name in ['precision', 'recall', 'fscore']:
+        for label, value in zip(labels, metrics[name]):
+            results['{}_{}'.format(name, label)] = float(value)
+    return results
+
+
+def bootstrap(matrix, replicates=1000, confidence=0.95, seed=42):
+    '''
+    Percentile bootstrap confidence intervals of the metrics. Resampling the rows of a case with replacement is the
+    same as drawing the counts of the confusion matrix from a multinomial with the observed cell frequencies, so all
+    replicates are drawn at once as a stack of confusion matrices.
+    :param matrix: confusion matrix of shape (n_labels, n_labels)
+    :type matrix: numpy.ndarray
+    :param replicates: number of resampled confusion matrices
+    :type replicates: int
+    :return: {metric: (low, high)} with the same metrics as scores
+    :rtype: dict
+    '''
+    matrix = np.asarray(matrix)
+    total = matrix.sum()
+    rng = np.random.default_rng(seed)
+    cells = matrix.ravel() / max(total, 1)
+    resampled = rng.multinomial(total, cells, size=replicates).reshape((replicates,) + matrix.shape)
+    tails = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    return {name: tuple(np.percentile(values, tails, axis=0)) for name, values in scores(resampled).items()}
+
+
+def interval_results(intervals, labels=LABELS):
+    '''
+    Flattens the intervals into the result schema, e.g. accuracy_low and accuracy_high
+    '''
+    results = {}
+    for i, bound in enumerate(['low', 'high']):
+        for name, value in to_results({name: values[i] for name, values in intervals.items()}, labels).items():
+            results['{}_{}'.format(name, bound)] = value
+    return results
+
+
+class ConfusionMatrix():
+    '''
+    Confusion matrix which can be updated chunk by chunk
+    '''
+
+    def __init__(self, labels=LABELS):
+        self.labels = labels
+        self.matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+
+    def update(self, expected, predictions):
+        self.matrix += confusion_matrix(expected, predictions, len(self.labels))
+        return self
+
+    def __iadd__(self, other):
+        self.matrix += other.matrix
+        return self
+
+    def results(self, bootstrap_replicates=0, confidence=0.95, seed=42):
+        '''
+        :param bootstrap_replicates: if set, also the bootstrap confidence interval of every metric
+        :type bootstrap_replicates: int
+        '''
+        results = to_results(scores(self.matrix), self.labels)
+        if bootstrap_replicates:
+            results.update(interval_results(bootstrap(self.matrix, bootstrap_replicates, confidence, seed),
+                                            self.labels))
+        return results
@@ -0,0 +1,83 @@
+import csv
+import sqlite3
+import time
+
+from utils import parse_id
+
+'''
+On-disk store of the module responses keyed by tweet id
+
+Responses are buffered and written in batches, each batch in one transaction, so a crash loses at most the
+unflushed batch and reruns only request the tweets which are not stored yet.
+'''
+
+COLUMNS = ['claim_conf', 'claim_cred', 'content_analys_conf', 'content_analys_cred', 'misinfome_conf',
+           'misinfome_cred']
+
+
+class ResponseStore():
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._buffer = []
+        self._connection = sqlite3.connect(str(path))
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses (id TEXT PRIMARY KEY, url TEXT, {}, fetched_at REAL)'.format(
+                ', '.join('{} REAL'.format(column) for column in COLUMNS)))
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def missing(self, tweet_urls, ttl=None):
+        '''
+        :param tweet_urls: tweet urls
+        :type tweet_urls: iterable
+        :param ttl: seconds after which a stored response is requested again, None keeps responses forever
+        :type ttl: float
+        :return: urls of the tweets without a stored response, one url per tweet id
+        :rtype: list
+        '''
+        min_fetched_at = time.time() - ttl if ttl is not None else float('-inf')
+        stored = set(tweet_id for tweet_id, in self._connection.execute(
+            'SELECT id FROM responses WHERE fetched_at >= ?', (min_fetched_at,)))
+        urls = {}
+        for url in tweet_urls:
+            tweet_id = parse_id(url)
+            if tweet_id is not None and tweet_id not in stored and tweet_id not in urls:
+                urls[tweet_id] = url
+        return list(urls.values())
+
+    def put(self, url, response):
+        self._buffer.append((parse_id(url), url) + tuple(response[column] for column in COLUMNS) + (time.time(),))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO responses VALUES ({})'.format(', '.join('?' * (len(COLUMNS) + 3))),
+                self._buffer)
+        self._buffer = []
+
+    def export_to_file(self, file_path):
+        '''
+        Writes all stored responses as tab separated file in one pass
+        '''
+        self.flush()
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            cw = csv.writer(f, delimiter='\t')
+            cw.writerow(['#id', 'url'] + COLUMNS)
+            cw.writerows(self._connection.execute(
+                'SELECT id, url, {} FROM responses ORDER BY rowid'.format(', '.join(COLUMNS))))
+
+    def close(self):
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,173 @@
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import aggregators
+import metrics
+import rule_table
+
+'''
+Content-addressed cache of evaluation results
+
+A result is stored under the hash of the case content, the aggregator name, the hash of the aggregator source or
+rule config and the evaluation options, so reruns serve every unchanged (case, aggregator) pair from the cache and
+only evaluate new or changed ones. Case digests are remembered by path, size and modification time, unchanged files
+are not read again. Entries are evicted least recently used first once the stored results exceed max_bytes.
+'''
+
+# part of every key, increase when the stored results change their meaning
+CACHE_VERSION = 1
+
+HASH_BLOCK_SIZE = 1 << 24
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def case_files(path):
+    '''
+    :param path: csv file or binary case directory
+    :return: files with the content of the case
+    :rtype: list
+    '''
+    path = Path(path)
+    if path.is_dir():
+        return sorted(child for child in path.iterdir() if child.is_file())
+    return [path]
+
+
+def case_signature(path):
+    '''
+    :return: names, sizes and modification times of the files of a case, changes when a file is rewritten
+    :rtype: tuple
+    '''
+    signature = []
+    for file in case_files(path):
+        stat = file.stat()
+        signature.append((file.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def aggregator_source(name):
+    '''
+    Source which decides the results of an aggregator: the policy json and the rule table compiler for policies, the
+    table for lookup tables and the module source of registered functions, which also covers their helpers
+    :rtype: bytes
+    '''
+    if name not in aggregators.methods and name.endswith('.npy'):
+        return file_digest(name).encode()
+    if name not in aggregators.methods and name.endswith('.json'):
+        path = Path(name)
+    elif name in aggregators.policies:
+        path = aggregators.POLICY_DIR / (name + '.json')
+    else:
+        return inspect.getsource(inspect.getmodule(aggregators.methods[name])).encode()
+    return path.read_bytes() + inspect.getsource(rule_table).encode()
+
+
+class ResultCache():
+    def __init__(self, path, max_bytes=64 * 2 ** 20):
+        '''
+        :param path: sqlite file of the cache
+        :type path: Path
+        :param max_bytes: size of the stored results after which the least recently used ones are evicted
+        :type max_bytes: int
+        '''
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._sources = {}
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path))
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, collection TEXT, '
+                                 'aggregator TEXT, results TEXT, size INTEGER, used_at REAL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                                 'mtime_ns INTEGER, digest TEXT)')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def case_digest(self, path):
+        '''
+        Hash of the content of a case, files with the size and modification time of their last hash are not read
+        '''
+        digest = hashlib.sha256()
+        with self._connection:
+            for file in case_files(path):
+                stat = file.stat()
+                key = str(file.resolve())
+                row = self._connection.execute('SELECT size, mtime_ns, digest FROM files WHERE path = ?',
+                                               (key,)).fetchone()
+                if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+                    row = (stat.st_size, stat.st_mtime_ns, file_digest(file))
+                    self._connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (key,) + row)
+                digest.update('{} {}\n'.format(file.name, row[2]).encode())
+        return digest.hexdigest()
+
+    def key(self, case_digest, aggregator, **options):
+        '''
+        :param options: evaluation options which change the results, e.g. the bootstrap replicates
+        :return: cache key of the results of an aggregator on a case
+        :rtype: str
+        '''
+        if aggregator not in self._sources:
+            self._sources[aggregator] = hashlib.sha256(aggregator_source(aggregator)).hexdigest()
+        if 'metrics' not in self._sources:
+            self._sources['metrics'] = hashlib.sha256(inspect.getsource(metrics).encode()).hexdigest()
+        content = [CACHE_VERSION, case_digest, aggregator, self._sources[aggregator], self._sources['metrics'],
+                   sorted(options.items())]
+        return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+    def get(self, key):
+        '''
+        :return: cached results or None, a hit makes the entry the most recently used one
+        :rtype: dict
+        '''
+        row = self._connection.execute('SELECT results FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._connection:
+            self._connection.execute('UPDATE results SET used_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, collection, aggregator, results):
+        text = json.dumps(results, ensure_ascii=False)
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                     (key, collection, aggregator, text, len(text), time.time()))
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the stored results fit into max_bytes
+        '''
+        total = 0
+        evicted = []
+        for key, size in self._connection.execute('SELECT key, size FROM results ORDER BY used_at DESC'):
+            total += size
+            if total > self.max_bytes:
+                evicted.append((key,))
+        if evicted:
+            with self._connection:
+                self._connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+        return len(evicted)
+
+    def close(self):
+        self._connection.close()
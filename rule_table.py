@@ -0,0 +1,123 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+'''
+Rule-table policies
+
+A policy is a json file which declares the credibility bands and the confidence gate of each module and how the
+modules are combined, e.g.
+
+{
+    "modules": {
+        "misinfome": {"cred": [0.66, 0.33, -0.33, -0.66], "conf": 0.5, "weight": 1.0},
+        ...
+    },
+    "combine": "majority",
+    "min_confident": 1
+}
+
+ - cred: descending band boundaries, a value >= cred[0] is in the first band, a value < cred[-1] in the last one
+ - conf: modules with a lower confidence do not take part in the combination
+ - weight: weight of the module in majority and weighted_mean, default 1
+ - band_labels: label of each band, default the first len(cred) + 1 labels
+ - combine: majority (weighted vote of the module bands), weighted_mean (bands of the weighted mean credibility
+   with the policy level "cred" boundaries) or most_confident (band of the module with the highest confidence)
+ - tie_break: label order which decides ties of majority, default the label order
+ - confidence_weighted: weighted_mean also weights the credibilities by their confidence
+ - min_confident: rows with fewer confident modules get unverified_label, default not_verifiable
+
+A policy is compiled into a batch aggregator which looks up the bands of all rows with searchsorted.
+'''
+
+COMBINE = ['majority', 'weighted_mean', 'most_confident']
+
+
+def _bands(boundaries, name):
+    boundaries = np.asarray(boundaries, dtype=np.float64)
+    if boundaries.ndim != 1 or (np.diff(boundaries) > 0).any():
+        raise ValueError('Credibility boundaries of {} must be a descending list'.format(name))
+    return boundaries[::-1]
+
+
+def _band_index(bounds, values):
+    '''
+    :param bounds: ascending band boundaries
+    :return: index of the band of each value, 0 is the band above all boundaries
+    '''
+    return len(bounds) - np.searchsorted(bounds, values, side='right')
+
+
+def compile_policy(policy, labels, modules):
+    '''
+    :param policy: rule table
+    :type policy: dict
+    :param labels: labels of the label codes
+    :type labels: list
+    :param modules: module names in column order of the batch arrays
+    :type modules: list
+    :return: batch aggregator
+    :rtype: function
+    '''
+    missing = [module for module in modules if module not in policy['modules']]
+    if missing:
+        raise ValueError('Policy has no rules for modules {}'.format(missing))
+    combine = policy.get('combine', 'majority')
+    if combine not in COMBINE:
+        raise ValueError('Unknown combination {}, select one of {}'.format(combine, COMBINE))
+
+    rules = [policy['modules'][module] for module in modules]
+    bounds = [_bands(rule['cred'], module) for rule, module in zip(rules, modules)]
+    gates = np.asarray([rule['conf'] for rule in rules], dtype=np.float64)
+    weights = np.asarray([rule.get('weight', 1.0) for rule in rules], dtype=np.float64)
+    band_labels = [np.asarray([labels.index(label) for label in rule.get('band_labels', labels[:len(bound) + 1])],
+                              dtype=np.int8) for rule, bound in zip(rules, bounds)]
+    unverified = labels.index(policy.get('unverified_label', 'not_verifiable'))
+    min_confident = policy.get('min_confident', 1)
+    tie_break = np.asarray([labels.index(label) for label in policy.get('tie_break', labels)])
+    if combine == 'weighted_mean':
+        mean_bounds = _bands(policy['cred'], 'the policy')
+        mean_labels = policy.get('band_labels', labels[:len(mean_bounds) + 1])
+        mean_labels = np.asarray([labels.index(label) for label in mean_labels], dtype=np.int8)
+
+    def module_labels(creds):
+        codes = np.empty(creds.shape, dtype=np.int8)
+        for j in range(creds.shape[1]):
+            codes[:, j] = band_labels[j][_band_index(bounds[j], creds[:, j])]
+        return codes
+
+    def aggregate(creds, confs):
+        confident = confs >= gates
+        if combine == 'majority':
+            codes = module_labels(creds)
+            votes = np.stack([((codes == code) & confident) @ weights for code in tie_break], axis=1)
+            result = tie_break[np.argmax(votes, axis=1)]
+        elif combine == 'weighted_mean':
+            row_weights = np.where(confident, weights, 0)
+            if policy.get('confidence_weighted', False):
+                # modules without confidence, also failed ones with NaN conf, have weight 0
+                row_weights = row_weights * np.where(confident, confs, 0)
+            total = row_weights.sum(axis=1)
+            mean = (np.where(confident, creds, 0) * row_weights).sum(axis=1) / np.where(total > 0, total, 1)
+            result = mean_labels[_band_index(mean_bounds, mean)]
+        else:
+            most_confident = np.argmax(np.where(confident, confs, -np.inf), axis=1)[:, None]
+            result = np.take_along_axis(module_labels(creds), most_confident, axis=1)[:, 0]
+        return np.where(confident.sum(axis=1) >= min_confident, result, unverified).astype(np.int8)
+
+    aggregate.batch = True
+    return aggregate
+
+
+def load_policy(path, labels, modules):
+    with open(path, encoding='utf-8') as f:
+        return compile_policy(json.load(f), labels, modules)
+
+
+def load_policies(policy_dir, labels, modules):
+    '''
+    :return: {file name without .json: batch aggregator} of all policies in policy_dir
+    :rtype: dict
+    '''
+    return {path.stem: load_policy(path, labels, modules) for path in sorted(Path(policy_dir).glob('*.json'))}
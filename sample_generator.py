@@ -1,30 +1,100 @@
-import argparse
-import csv
+import hashlib
+import json
 import os
 import re
 import sys
+import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import requests
-from dotenv import load_dotenv
 from loguru import logger
 
-logger.add(sys.stderr, level="INFO")
-logger.add("debug.log", level="DEBUG", rotation="500 MB")
-
-np.random.seed(seed=42)
+import timing
+from arguments import ENV_FILE, SAMPLE_MODES, generate_parser
+from response_store import ResponseStore
+from sample_io import CaseWriter
+from utils import parse_id, parse_ids
 
 ROOT = Path(os.path.dirname(os.path.dirname(__file__))) / Path(os.path.basename(os.path.dirname(__file__)))
 DATA_DIR = ROOT / 'data'
-env_path = ROOT / '.env'
-load_dotenv(dotenv_path=env_path)
+
+def setup_logging():
+    '''
+    Adds the log sinks, called by the commands instead of at import
+    '''
+    logger.add(sys.stderr, level="INFO")
+    logger.add("debug.log", level="DEBUG", rotation="500 MB")
+
 
 # =================== COINFORM API SETTINGS =================
-COINFORM_ENDPOINT = os.getenv('COINFORM_ENDPOINT')
-QUERY_ID_REQUEST = COINFORM_ENDPOINT + '/twitter/tweet'
-RESPONSE_TWEET = COINFORM_ENDPOINT + '/response/{query_id}/debug'
+def coinform_endpoint():
+    '''
+    Reads the policy manager endpoint from the environment or the .env file, only the commands which send requests
+    need it
+    :rtype: str
+    '''
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=ENV_FILE)
+    endpoint = os.getenv('COINFORM_ENDPOINT')
+    if not endpoint:
+        raise ValueError('COINFORM_ENDPOINT is not set in the environment or {}'.format(ENV_FILE))
+    return endpoint
+
+
+# first spawn key of the random streams, credibilities of all_agree are shared by the modes built on them
+STREAMS = {'all_not_verified': 0, 'all_agree_all_high': 1, 'some_agree': 2, 'all_agree_some_high': 3, 'all_agree': 4}
+CRED = 0
+CONF = 1
+
+# modes built on the credibilities of _all_agree_helper
+ALL_AGREE_MODES = ['all_not_verified', 'all_agree_all_high', 'all_agree_some_high']
+
+# columns of joined_tables.tsv read by the ingestion and the rows read at a time
+INGEST_DTYPES = {'url': str, 'lang': 'category', 'source': 'category', 'factchecker_label': 'category'}
+INGEST_CHUNK_SIZE = 1000000
+
+# folder in DATA_DIR with the reports of the cases with rows outside of their bands
+VALIDATION_DIR = 'validation'
+
+
+def load_modules(path):
+    '''
+    Reads the thresholds of the modules from a json config, e.g.
+    {"modules": [{"name": "misinfome", "cred": [0.66, 0.33, -0.33, -0.66], "conf": 0.5}, ...]}
+    :return: {module: [cred boundaries, conf]} in config order
+    :rtype: dict
+    :raises ValueError: if a module has not 4 descending credibility boundaries
+    '''
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    modules = {}
+    for module in config['modules']:
+        if len(module['cred']) != 4:
+            raise ValueError('Module {} needs 4 credibility boundaries, got {}'.format(module['name'], module['cred']))
+        if any(high < low for high, low in zip(module['cred'], module['cred'][1:])):
+            raise ValueError('Credibility boundaries of module {} must be descending, got {}'.format(
+                module['name'], module['cred']))
+        modules[module['name']] = [module['cred'], module['conf']]
+    return modules
+
+
+def scale_modules(modules, n_modules):
+    '''
+    :return: the first n_modules modules, modules beyond the configured ones repeat their thresholds as {name}_{k}
+    :rtype: dict
+    '''
+    names = list(modules)
+    scaled = {}
+    for j in range(n_modules):
+        name = names[j % len(names)]
+        scaled[name if j < len(names) else '{}_{}'.format(name, j // len(names))] = modules[name]
+    return scaled
+
 
 class Sample_Generator():
     def __init__(self, args):
@@ -44,304 +114,385 @@ class Sample_Generator():
         self.labels = {'credible': 0, 'mostly_credible': 1, 'mostly_not_credible': 2, 'credible_uncertain': 3,
                        'not_credible': 4,
                        'not_verifiable': 5}
-        self.modules = {'misinfome': [self.misinfome_cred, self.misinfome_conf],
-                        'content_analys': [self.content_analys_cred, self.content_analys_conf],
-                        'claim': [self.claim_cred, self.claim_conf]}
+        # fetcher settings
+        self.concurrency = args.concurrency
+        self.query_timeout = args.query_timeout
+        self.response_ttl = args.response_ttl
+
+        # rows per chunk of each label band, None generates each band at once
+        self.chunk_size = args.chunk_size
+        self.output_format = args.output_format
+        self.seed = args.seed
+        self.workers = args.workers
+        # off, report or fail on generated rows outside of their declared bands
+        self.validate = args.validate
+        self.max_violations = args.max_violations
+
+        # thresholds of each module in column order of the values, the csv column prefix is the module name
+        self.modules_config = args.modules_config
+        if self.modules_config is not None:
+            self.modules = load_modules(self.modules_config)
+        else:
+            self.modules = {'misinfome': [self.misinfome_cred, self.misinfome_conf],
+                            'content_analys': [self.content_analys_cred, self.content_analys_conf],
+                            'claim': [self.claim_cred, self.claim_conf]}
+        if self.total_modules is not None:
+            self.modules = scale_modules(self.modules, self.total_modules)
+
+    def _stream(self, *key):
+        '''
+        Independent random stream of the seed for the key, e.g. (mode, band, chunk, module, column)
+        '''
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
 
+    def _chunk_positions(self):
+        '''
+        Index, offset in the band and size of the chunks of each label band, one chunk of n_samples if chunk_size
+        is not set
+        '''
+        chunk_size = self.chunk_size or self.total_sample
+        for chunk, start in enumerate(range(0, self.total_sample, chunk_size)):
+            yield chunk, start, min(chunk_size, self.total_sample - start)
 
-    def _all_agree_helper(self):
-        labels = list(self.labels.keys())
-        data = pd.DataFrame()
-        misinfome_creds = []
-        content_analys_creds = []
-        claim_creds = []
-        cred_labels = []
-
-        for i in range(0, len(labels) - 1):
-            if i == 0:
-                misinfome_creds.append(np.random.uniform(high=1, low=self.misinfome_cred[i],
-                                                         size=self.total_sample))
-                content_analys_creds.append(np.random.uniform(high=1,
-                                                              low=self.content_analys_cred[i],
-                                                              size=[self.total_sample]))
-                claim_creds.append(np.random.uniform(high=1, low=self.claim_cred[i],
-                                                     size=[self.total_sample]))
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-
-            elif i == 4:
-                misinfome_creds.append(np.random.uniform(high=self.misinfome_cred[i - 1],
-                                                         low=-1,
-                                                         size=[self.total_sample]))
-                content_analys_creds.append(np.random.uniform(high=self.content_analys_cred[i - 1],
-                                                              low=-1,
-                                                              size=[self.total_sample]))
-                claim_creds.append(np.random.uniform(high=self.claim_cred[i - 1], low=-1,
-                                                     size=[self.total_sample]))
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-            else:
-
-                misinfome_creds.append(np.random.uniform(high=self.content_analys_cred[i - 1],
-                                                         low=self.content_analys_cred[i],
-                                                         size=[self.total_sample]))
-                content_analys_creds.append(np.random.uniform(high=self.content_analys_cred[i - 1],
-                                                              low=self.content_analys_cred[i],
-                                                              size=[self.total_sample]))
-                claim_creds.append(np.random.uniform(high=self.claim_cred[i - 1],
-                                                     low=self.claim_cred[i], size=[self.total_sample]))
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-
-        data['misinfome_cred'] = np.asarray(misinfome_creds).flatten()
-        data['content_analys_cred'] = np.asarray(content_analys_creds).flatten()
-        data['claim_cred'] = np.asarray(claim_creds).flatten()
-        data['expected_credible'] = np.asarray(cred_labels).flatten()
+    def _band_bounds(self, module, i):
+        '''
+        :return: low and high credibility of label band i of the module
+        :rtype: tuple
+        '''
+        cred = self.modules[module][0]
+        if i == 0:
+            return cred[i], 1
+        if i == len(cred):
+            return -1, cred[i - 1]
+        # boundaries which are not descending, e.g. the default claim_cred, give the band between them
+        return min(cred[i], cred[i - 1]), max(cred[i], cred[i - 1])
+
+    def _cred(self, j, i, chunk, size):
+        '''
+        Credibility values of module j in label band i for a chunk. The values do not depend on the mode, so every
+        mode built on them shares the same credibilities.
+        '''
+        module = list(self.modules)[j]
+        low, high = self._band_bounds(module, i)
+        rng = self._stream(STREAMS['all_agree'], i, chunk, j, CRED)
+        return rng.uniform(high=high, low=low, size=size)
 
-        return data
+    def _all_agree_helper(self, i, chunk, size):
+        '''
+        Credibility values on which all modules agree for a chunk of label band i
+        :return: creds of shape (size, modules)
+        :rtype: numpy.ndarray
+        '''
+        creds = np.empty((size, len(self.modules)), dtype=np.float32)
+        for j in range(len(self.modules)):
+            creds[:, j] = self._cred(j, i, chunk, size)
+        return creds
 
-    def _pick_random_modules(self, num_diff_module):
+    def _values(self, i, chunk, size, shared=None):
         '''
-        :param num_module: number of module which has different functions
-        :type num_module: int
-        :return:
-        :rtype:
+        :param shared: creds of _all_agree_helper, drawn if not given
+        :return: chunk with the values of shape (size, modules, 2), the creds of band i filled in, and the expected
+            label codes of band i
+        :rtype: dict
         '''
-        all_idxs = set([i for i in range(len(self.modules.keys()))])
-        disagree_idxs = set()
-        picked_flag = False
-        for i in range(num_diff_module):
-            while not picked_flag:
-                picked_num = np.random.randint(high=len(self.modules.keys()), low=0, size=1)[0]
-                if picked_num not in disagree_idxs:
-                    disagree_idxs.add(picked_num)
-                    picked_flag = True
-
-        agree_idxs = all_idxs - disagree_idxs
-        return {'agree': [list(self.modules.keys())[agree_idx] for agree_idx in agree_idxs],
-                'disagree': [list(self.modules.keys())[disagree_idx] for disagree_idx in disagree_idxs]}
-
-    def _pick_random_label(self, idx_agreed):
+        values = np.empty((size, len(self.modules), 2), dtype=np.float32)
+        values[:, :, CRED] = self._all_agree_helper(i, chunk, size) if shared is None else shared
+        return {'values': values, 'expected_credible': np.full(size, i, dtype=np.int8)}
+
+    def _conf(self, module, high_conf, size, *key):
+        conf = self.modules[module][1]
+        rng = self._stream(*key)
+        if high_conf:
+            return rng.uniform(high=1, low=conf, size=size)
+        return rng.uniform(high=conf, low=0, size=size)
+
+    def _pick_random_modules(self, num_diff_module, rng):
+        '''
+        :param num_diff_module: number of modules which disagree
+        :type num_diff_module: int
+        :param rng: random stream
+        :type rng: numpy.random.Generator
+        :return: agreeing and disagreeing modules in column order
+        :rtype: dict
+        '''
+        modules = list(self.modules.keys())
+        disagree_idxs = set(rng.choice(len(modules), num_diff_module, replace=False).tolist())
+        return {'agree': [module for j, module in enumerate(modules) if j not in disagree_idxs],
+                'disagree': [module for j, module in enumerate(modules) if j in disagree_idxs]}
+
+    def _pick_random_label(self, idx_agreed, rng):
         labels = list(self.labels.keys())
         picked_flag = False
         picked_id = None
         while (not picked_flag):
-            random_idx = np.random.randint(high=len(labels), low=0, size=1)[0]
+            random_idx = rng.integers(high=len(labels), low=0, size=1)[0]
             if random_idx is not idx_agreed:
                 picked_id = random_idx
                 picked_flag = True
 
         return labels[picked_id]
 
-    def some_agree(self):
+    def _sections(self):
         '''
-        This method creates values that some modules agree, some disagree with high/low confidence
-        :return:
-        :rtype:
+        Sections of some_agree, one with low and one with high confidence of the disagreeing modules for each number
+        of disagreeing modules
+        :return: (section, {'agree': modules, 'disagree': modules}, high confidence of the disagreeing modules)
+        :rtype: list
         '''
-        dummy_values = pd.DataFrame()
-        # if data folder does not exist, create
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
+        sections = []
+        for section, (num_diff_module, confidence_density) in enumerate(
+                (i, density) for i in range(1, len(self.modules.keys()) + 1) for density in (False, True)):
+            random_modules = self._pick_random_modules(num_diff_module, self._stream(STREAMS['some_agree'], section))
+            sections.append((section, random_modules, confidence_density))
+        return sections
+
+    def _tasks(self, mode):
+        '''
+        Chunks of a mode in output order, each chunk is generated from its own random streams. The sections of
+        some_agree follow each other within a chunk, so they are derived from the same shared credibilities.
+        :return: (mode, label band, chunk index, offset in the band, size, extra parameters of the mode)
+        :rtype: list
+        '''
+        tasks = []
+        sections = self._sections() if mode == 'some_agree' else [None]
+        for i in range(0, len(self.labels.keys()) - 1):
+            for chunk, start, size in self._chunk_positions():
+                for section in sections:
+                    tasks.append((mode, i, chunk, start, size, section))
+        return tasks
 
-        for i in range(1, len(self.modules.keys()) + 1):
-            data_low_conf = self._some_agree_helper(num_diff_module=i, confidence_density=False)
-            dummy_values = dummy_values.append(data_low_conf, ignore_index=True, sort=True)
-            data_high_conf = self._some_agree_helper(num_diff_module=i, confidence_density=True)
-            dummy_values = dummy_values.append(data_high_conf, ignore_index=True, sort=True)
+    def _chunk(self, task):
+        mode, i, chunk, start, size, extra = task
+        with timing.stage('draw_bands', rows=size, mode=mode, band=i, chunk=chunk):
+            return getattr(self, '_' + mode)(i, chunk, start, size, extra)
 
-        # save dummy values {casename}_{module_name}_{upboundary_cred}_{conf}
-        path = DATA_DIR / '{func_name}_misinfome_{misinfome_cred}_{misinfome_conf}_contentanalysis_{content_analysis_cred}_{content_analysis_conf}_claim_{claim_cred}_{claim_conf}.csv'.format(
-            func_name=self.some_agree.__name__,
-            misinfome_cred=str(self.misinfome_cred[0]), misinfome_conf=str(self.misinfome_conf),
-            content_analysis_conf=self.content_analys_conf, content_analysis_cred=self.content_analys_cred[0],
-            claim_cred=str(self.claim_cred[0]), claim_conf=self.claim_conf)
-        dummy_values.to_csv(path)
+    def _neighbour(self, i):
+        '''
+        :return: label band of the disagreeing modules of some_agree in band i
+        :rtype: int
+        '''
+        return i + 1 if i == 0 else i - 1
 
-    def _some_agree_helper(self, num_diff_module, confidence_density):
+    def _some_agree(self, i, chunk, start, size, extra, shared=None):
         '''
-        :param num_diff_module: number of modules which disgree
-        :type num_diff_module: int
-        :param confidence_density: confidence density of disagreed modules. If it is true, modules disagree with high confidence
-        :type: boolean
+        Agreed modules take the shared credibilities of label band i with high confidence, disagreed modules the ones
+        of the neighbour band (i+1 for credible, i-1 otherwise) with high or low confidence
+        :param shared: {band: creds of _all_agree_helper} of band i and its neighbour, drawn if not given
+        '''
+        section, random_modules, confidence_density = extra
+        values = np.empty((size, len(self.modules), 2), dtype=np.float32)
+        for j, module in enumerate(self.modules):
+            agreed = module in random_modules['agree']
+            band = i if agreed else self._neighbour(i)
+            values[:, j, CRED] = self._cred(j, band, chunk, size) if shared is None else shared[band][:, j]
+            values[:, j, CONF] = self._conf(module, agreed or confidence_density, size,
+                                            STREAMS['some_agree'], section, i, chunk, j, CONF)
+        return {'values': values, 'expected_credible': np.full(size, i, dtype=np.int8)}
+
+    def some_agree(self):
+        '''
+        This method creates values that some modules agree, some disagree with high/low confidence
         :return:
         :rtype:
         '''
-        #### 2 modules agree, one is not ######
-        random_modules = self._pick_random_modules(num_diff_module=num_diff_module)
-        agreed_modules = random_modules['agree']
-        disagreed_modules = random_modules['disagree']
-        labels = list(self.labels.keys())
-        temp_creds = {'misinfome': [], 'content_analys': [], 'claim': []}
-        temp_confs = {'misinfome': [], 'content_analys': [], 'claim': []}
-        cred_labels = []
-        data = pd.DataFrame()
-        print('Agreed modules {}'.format(agreed_modules))
-        print('Disagreed modules {}'.format(disagreed_modules))
-        for i in range(0, len(self.labels.keys()) - 1):
-            if i == 0:
-                for agreed_module in agreed_modules:
-                    temp_creds[agreed_module].append(np.random.uniform(high=1, low=self.modules[agreed_module][0][i],
-                                                                       size=self.total_sample))
-                    # high confidence
-                    temp_confs[agreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[agreed_module][1], size=self.total_sample))
-
-                    # agreed module -> credible, disagreed modules  -> mostly credible (i+1), but disagree module's label is not final.
-                for disagreed_module in disagreed_modules:
-                    temp_creds[disagreed_module].append(np.random.uniform(high=self.modules[disagreed_module][0][i],
-                                                                          low=self.modules[disagreed_module][0][i + 1],
-                                                                          size=self.total_sample))
-                    temp_confs[disagreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[disagreed_module][1],
-                                          size=self.total_sample)) if confidence_density else temp_confs[
-                        disagreed_module].append(
-                        np.random.uniform(high=self.modules[disagreed_module][1], low=0, size=self.total_sample))
-
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-
-            elif i == 4:
-                for agreed_module in agreed_modules:
-                    temp_creds[agreed_module].append(np.random.uniform(high=self.modules[agreed_module][0][i - 1],
-                                                                       low=-1,
-                                                                       size=self.total_sample))
-                    # high confidence
-                    temp_confs[agreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[agreed_module][1], size=self.total_sample))
-                    # agreed module -> not credible, disagreed modules -> credible uncertain (i-1)
-                for disagreed_module in disagreed_modules:
-                    temp_creds[disagreed_module].append(np.random.uniform(high=self.modules[disagreed_module][0][i - 1],
-                                                                          low=self.modules[disagreed_module][0][i - 2],
-                                                                          size=self.total_sample))
-                    temp_confs[disagreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[disagreed_module][1],
-                                          size=self.total_sample)) if confidence_density else temp_confs[
-                        disagreed_module].append(
-                        np.random.uniform(high=self.modules[disagreed_module][1], low=0, size=self.total_sample))
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-            else:
-                for agreed_module in agreed_modules:
-                    temp_creds[agreed_module].append(np.random.uniform(high=self.modules[agreed_module][0][i - 1],
-                                                                       low=self.modules[agreed_module][0][i],
-                                                                       size=
-                                                                       self.total_sample))
-                    # high confidence
-                    temp_confs[agreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[agreed_module][1], size=self.total_sample))
-                    # disagreed module -> preeceding (i-1)
-                for disagreed_module in disagreed_modules:
-                    # preeceding label
-                    temp_creds[disagreed_module].append(np.random.uniform(high=self.modules[disagreed_module][0][i - 1],
-                                                                          low=self.modules[disagreed_module][0][i - 2],
-                                                                          size=
-                                                                          self.total_sample))
-                    temp_confs[disagreed_module].append(
-                        np.random.uniform(high=1, low=self.modules[disagreed_module][1],
-                                          size=self.total_sample)) if confidence_density else temp_confs[
-                        disagreed_module].append(
-                        np.random.uniform(high=self.modules[disagreed_module][1], low=0, size=self.total_sample))
-                cred_labels.append(np.asarray([labels[i] for _ in range(self.total_sample)]))
-
-        for name, values in temp_creds.items():
-            data[name + '_cred'] = np.asarray(values).flatten()
-            data[name + '_conf'] = np.asarray(temp_confs[name]).flatten()
-        data['expected_credible'] = np.asarray(cred_labels).flatten()
+        self._generate(self.some_agree.__name__)
+
+    def _all_agree_all_high(self, i, chunk, start, size, extra, shared=None):
+        data = self._values(i, chunk, size, shared)
+        # confidence value always high between th>val>1
+        for j, module in enumerate(self.modules):
+            data['values'][:, j, CONF] = self._conf(module, True, size,
+                                                    STREAMS['all_agree_all_high'], i, chunk, j, CONF)
         return data
 
     def all_agree_all_high(self):
         '''
         In this case all of modules agree on one credibility label with high confidence
         '''
-        dummy_values = pd.DataFrame()
-        # if data folder does not exist, create
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
-
-        data = self._all_agree_helper()
-
-        # confidence value always high between th>val>1
-        data['misinfome_conf'] = np.random.uniform(high=1, low=self.misinfome_conf, size=[data.shape[0]])
-        data['content_analys_conf'] = np.random.uniform(high=1, low=self.content_analys_conf,
-                                                        size=[data.shape[0]])
-        data['claim_conf'] = np.random.uniform(high=1, low=self.claim_conf, size=[data.shape[0]])
+        self._generate(self.all_agree_all_high.__name__)
+
+    def _all_agree_some_high(self, i, chunk, start, size, extra, shared=None):
+        data = self._values(i, chunk, size, shared)
+        # confidence value always high between th>val>1 for the first half of the samples, low val>0 for the rest
+        n_high = self._n_high(i, start, size)
+        for j, module in enumerate(self.modules):
+            data['values'][:n_high, j, CONF] = self._conf(module, True, n_high,
+                                                          STREAMS['all_agree_some_high'], i, chunk, j, CONF)
+            data['values'][n_high:, j, CONF] = self._conf(module, False, size - n_high,
+                                                          STREAMS['all_agree_some_high'], i, chunk, j, CONF + 1)
+        return data
 
-        dummy_values = dummy_values.append(data, ignore_index=True, sort=True)
-        # save dummy values {casename}_{module_name}_{upboundary_cred}_{conf}
-        path = DATA_DIR / '{func_name}_misinfome_{misinfome_cred}_{misinfome_conf}_contentanalysis_{content_analysis_cred}_{content_analysis_conf}_claim_{claim_cred}_{claim_conf}.csv'.format(
-            func_name=self.all_agree_all_high.__name__,
-            misinfome_cred=str(self.misinfome_cred[0]), misinfome_conf=str(self.misinfome_conf),
-            content_analysis_conf=self.content_analys_conf, content_analysis_cred=self.content_analys_cred[0],
-            claim_cred=str(self.claim_cred[0]), claim_conf=self.claim_conf)
-        dummy_values.to_csv(path)
+    def _n_high(self, i, start, size):
+        '''
+        :return: rows of a chunk of all_agree_some_high with high confidence, the first half of the case has them
+        :rtype: int
+        '''
+        high_conf_sample = (len(self.labels) - 1) * self.total_sample // 2
+        return min(max(high_conf_sample - i * self.total_sample - start, 0), size)
 
     def all_agree_some_high(self):
         '''
         In this case all of modules agree on one credibility label, but some of them with high confidence
         '''
-        dummy_values = pd.DataFrame()
-        # if data folder does not exist, create
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
+        self._generate(self.all_agree_some_high.__name__)
 
-        data = self._all_agree_helper()
-
-        misinfo_conf = []
-        content_analys_conf = []
-        claim_conf = []
-        # confidence value always high between th>val>1 half high
-        high_conf_sample = data.shape[0] // 2
-        low_conf_sample = data.shape[0] - high_conf_sample
+    def _all_not_verified(self, i, chunk, start, size, extra, shared=None):
+        data = self._values(i, chunk, size, shared)
+        # all of them has low confidence, hence they are unverified.
+        for j, module in enumerate(self.modules):
+            data['values'][:, j, CONF] = self._conf(module, False, size, STREAMS['all_not_verified'], i, chunk, j,
+                                                    CONF)
 
-        misinfo_conf.append(np.random.uniform(high=1, low=self.misinfome_conf, size=[high_conf_sample]))
+        # label credibility
+        data['expected_credible'][:] = self.labels['not_verifiable']
+        return data
 
-        content_analys_conf.append(np.random.uniform(high=1, low=self.content_analys_conf,
-                                                     size=high_conf_sample))
-        claim_conf.append(np.random.uniform(high=1, low=self.claim_conf, size=high_conf_sample))
+    def all_not_verified(self):
+        '''
+        All of them have low confidence or either fail
+        todo: fail case is not implemented
+        '''
+        self._generate(self.all_not_verified.__name__)
 
-        # confidence value always low val>0
-        misinfo_conf.append(np.random.uniform(high=self.misinfome_conf, low=0, size=low_conf_sample))
-        content_analys_conf.append(np.random.uniform(high=self.content_analys_conf, low=0,
-                                                     size=low_conf_sample))
-        claim_conf.append(np.random.uniform(high=self.claim_conf, low=0, size=low_conf_sample))
+    def chunks(self, mode):
+        '''
+        Chunks are generated in self.workers processes, the result is the same for any number of workers
+        :param mode: sample mode e.g. some_agree
+        :type mode: str
+        :return: chunks of {column: values} of the mode in output order without writing them
+        :rtype: generator
+        '''
+        if mode not in SAMPLE_MODES:
+            raise ValueError('Unknown sample mode {}'.format(mode))
+        return self._map(self._chunk, self._tasks(mode))
 
-        data['misinfome_conf'] = np.asarray(misinfo_conf).flatten()
-        data['content_analys_conf'] = np.asarray(content_analys_conf).flatten()
-        data['claim_conf'] = np.asarray(claim_conf).flatten()
+    def _map(self, func, tasks):
+        '''
+        Runs func on the tasks in self.workers processes and yields the results in task order, a bounded number of
+        tasks is in flight so memory does not grow with n_samples
+        '''
+        if self.workers <= 1:
+            for task in tasks:
+                yield func(task)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=timing.configure,
+                                 initargs=timing.settings()) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append(executor.submit(func, task))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _all_agree_modes(self, task):
+        '''
+        Draws the shared credibilities of a chunk once, for its band and the neighbour band of some_agree, and derives
+        the chunk of every mode built on them
+        :return: {mode: chunk}, {band: shared creds}, seconds spent on each
+        :rtype: tuple
+        '''
+        mode, i, chunk, start, size, extra = task
+        seconds = {}
+        with timing.stage('draw_bands', rows=size * len(ALL_AGREE_MODES), mode='all', band=i, chunk=chunk):
+            begin = time.perf_counter()
+            shared = {band: self._all_agree_helper(band, chunk, size) for band in (i, self._neighbour(i))}
+            seconds['shared_creds'] = time.perf_counter() - begin
+            chunks = {}
+            for mode in ALL_AGREE_MODES:
+                begin = time.perf_counter()
+                chunks[mode] = getattr(self, '_' + mode)(i, chunk, start, size, extra, shared=shared[i])
+                seconds[mode] = time.perf_counter() - begin
+        return chunks, shared, seconds
+
+    def all_modes(self):
+        '''
+        Writes the cases of every sample mode in one pass. The credibility bands are drawn once per chunk, the modes
+        built on _all_agree_helper take the ones of their band and the sections of some_agree also the ones of the
+        neighbour band.
+        :return: seconds spent on each mode
+        :rtype: dict
+        '''
+        seconds = {mode: 0.0 for mode in ['shared_creds'] + SAMPLE_MODES}
+        tasks = self._tasks(ALL_AGREE_MODES[0])
+        sections = self._sections()
+        with ExitStack() as stack:
+            # a failing validator raises on configuration violations before any case is opened
+            validators = {mode: self._validator(mode) for mode in SAMPLE_MODES}
+            writers = {mode: stack.enter_context(self._case_writer(mode)) for mode in SAMPLE_MODES}
+
+            def write(mode, task, data):
+                if validators[mode] is not None:
+                    validators[mode](task, data)
+                writers[mode].write(data)
+
+            for task, (chunks, shared, chunk_seconds) in zip(tasks, self._map(self._all_agree_modes, tasks)):
+                for mode, data in chunks.items():
+                    begin = time.perf_counter()
+                    write(mode, task, data)
+                    seconds[mode] += chunk_seconds[mode] + time.perf_counter() - begin
+                seconds['shared_creds'] += chunk_seconds['shared_creds']
+                begin = time.perf_counter()
+                for section in sections:
+                    some_task = ('some_agree',) + task[1:5] + (section,)
+                    with timing.stage('draw_bands', rows=task[4], mode='some_agree', band=task[1], chunk=task[2]):
+                        data = self._some_agree(*some_task[1:], shared=shared)
+                    write('some_agree', some_task, data)
+                seconds['some_agree'] += time.perf_counter() - begin
+            for validator in validators.values():
+                if validator is not None:
+                    validator.finish()
+        for mode, value in seconds.items():
+            print('{:<20} {:.3f}s'.format(mode, value))
+        return seconds
+
+    def _validator(self, mode):
+        if self.validate == 'off':
+            return None
+        return BandValidator(self, mode, self._case_path(mode).name, self.max_violations, self.validate == 'fail')
 
-        dummy_values = dummy_values.append(data, ignore_index=True, sort=True)
-        # save dummy values {casename}_{module_name}_{upboundary_cred}_{conf}
-        path = DATA_DIR / '{func_name}_misinfome_{misinfome_cred}_{misinfome_conf}_contentanalysis_{content_analysis_cred}_{content_analysis_conf}_claim_{claim_cred}_{claim_conf}.csv'.format(
-            func_name=self.all_agree_some_high.__name__,
-            misinfome_cred=str(self.misinfome_cred[0]), misinfome_conf=str(self.misinfome_conf),
-            content_analysis_conf=self.content_analys_conf, content_analysis_cred=self.content_analys_cred[0],
-            claim_cred=str(self.claim_cred[0]), claim_conf=self.claim_conf)
-        dummy_values.to_csv(path)
+    def _generate(self, mode):
+        '''
+        Writes the case of a mode, every chunk is validated against the declared bands before it is written
+        '''
+        tasks = self._tasks(mode)
+        chunks = self._map(self._chunk, tasks)
+        validator = self._validator(mode)
+        self._save(mode, chunks if validator is None else validator.validated(tasks, chunks))
 
-    def all_not_verified(self):
+    def _save(self, func_name, chunks, path=None):
         '''
-        All of them have low confidence or either fail
-        todo: fail case is not implemented
+        Writes the chunks one after another to the csv file and/or binary case directory, only one chunk is in memory
+        at a time
+        :param func_name: name of the case
+        :type func_name: str
+        :param chunks: chunks of {column: values}
+        :type chunks: iterable
+        :param path: case path without suffix, by default the one named by the mode and thresholds
+        :type path: Path
         '''
-        dummy_values = pd.DataFrame()
+        with self._case_writer(func_name, path) as writer:
+            for data in chunks:
+                writer.write(data)
+
+    def _case_writer(self, func_name, path=None):
         # if data folder does not exist, create
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
-        data = self._all_agree_helper()
-
-        # all of them has low confidence, hence they are unverified.
-        data['misinfome_conf'] = np.random.uniform(high=self.misinfome_conf, low=0, size=[data.shape[0]]).flatten()
-        data['content_analys_conf'] = np.random.uniform(high=self.content_analys_conf, low=0,
-                                                        size=[data.shape[0]]).flatten()
-        data['claim_conf'] = np.random.uniform(high=self.claim_conf, low=0, size=[data.shape[0]]).flatten()
-
-        # label credibility
-        data['expected_credible'] = 'not_verifiable'
-
-        dummy_values = dummy_values.append(data, ignore_index=True, sort=True)
+        return CaseWriter(path or self._case_path(func_name), self.output_format, self.labels, list(self.modules))
+
+    def _case_path(self, func_name):
+        if self.modules_config is not None or len(self.modules) != 3:
+            config = Path(self.modules_config).stem if self.modules_config is not None else 'args'
+            # runs with other thresholds of the modules write other cases
+            thresholds = hashlib.sha256(json.dumps(list(self.modules.items())).encode()).hexdigest()[:8]
+            return DATA_DIR / '{}_{}_modules_{}_{}'.format(func_name, len(self.modules), config, thresholds)
         # save dummy values {casename}_{module_name}_{upboundary_cred}_{conf}
-        path = DATA_DIR / '{func_name}_misinfome_{misinfome_cred}_{misinfome_conf}_contentanalysis_{content_analysis_cred}_{content_analysis_conf}_claim_{claim_cred}_{claim_conf}.csv'.format(
-            func_name=self.all_agree_some_high.__name__,
+        return DATA_DIR / '{func_name}_misinfome_{misinfome_cred}_{misinfome_conf}_contentanalysis_{content_analysis_cred}_{content_analysis_conf}_claim_{claim_cred}_{claim_conf}'.format(
+            func_name=func_name,
             misinfome_cred=str(self.misinfome_cred[0]), misinfome_conf=str(self.misinfome_conf),
             content_analysis_conf=self.content_analys_conf, content_analysis_cred=self.content_analys_cred[0],
             claim_cred=str(self.claim_cred[0]), claim_conf=self.claim_conf)
-        dummy_values.to_csv(path)
 
     def _map_label(self, label):
         print('Not implemented yet!!')
@@ -349,72 +500,40 @@ class Sample_Generator():
 
     def _request(self, tweet_id):
         # logger.debug('I am requesting tweet {}'.format(tweet_id))
-        args = {
-            "tweet_id": parse_id(tweet_id),
-            "tweet_author": "string",
-            "tweet_text": "string"
-        }
-        # first response includes query id
-        response_1 = requests.post(QUERY_ID_REQUEST, json=args).json()
-        if 'query_id' not in response_1:
-            return None
-        query_id = response_1['query_id']
-        task_completed = False
-        modules_response = {}
-
-        err_count = 100
-        while (not task_completed):
-            response_2 = requests.get(RESPONSE_TWEET.format(query_id=query_id)).json()
-            status = response_2['status']
-            # logger.debug('Query response {}'.format(status))
-            if status == 'partly_done' or status == 'in_progress':
-                err_count -= 1
-                if err_count == 0:
-                    status = 'done'
-            if status == 'done':
-                response_codes = response_2['module_response_code']
-                logger.debug(response_2['flattened_module_responses'])
-                if response_codes[
-                    'claimcredibility'] == 200 and 'claimcredibility_tweet_claim_credibility_0_confidence' in \
-                        response_2['flattened_module_responses']:
-                    modules_response['claim_conf'] = response_2['flattened_module_responses'][
-                        'claimcredibility_tweet_claim_credibility_0_confidence']
-                    modules_response['claim_cred'] = response_2['flattened_module_responses'][
-                        'claimcredibility_tweet_claim_credibility_0_credibility']
-                else:
-                    modules_response['claim_conf'] = -100
-                    modules_response['claim_cred'] = -100
-                if response_codes['contentanalysis'] == 200 and 'contentanalysis_credibility' in response_2[
-                    'flattened_module_responses']:
-                    modules_response['content_analys_conf'] = response_2['flattened_module_responses'][
-                        'contentanalysis_confidence']
-                    modules_response['content_analys_cred'] = response_2['flattened_module_responses'][
-                        'contentanalysis_credibility']
-                else:
-                    modules_response['content_analys_conf'] = -100
-                    modules_response['content_analys_cred'] = -100
-                if response_codes['misinfome'] == 200 and 'misinfome_credibility_value' in response_2[
-                    'flattened_module_responses']:
-                    modules_response['misinfome_conf'] = response_2['flattened_module_responses'][
-                        'misinfome_credibility_confidence']
-                    modules_response['misinfome_cred'] = response_2['flattened_module_responses'][
-                        'misinfome_credibility_value']
-                else:
-                    modules_response['misinfome_conf'] = -100
-                    modules_response['misinfome_cred'] = -100
-
-                task_completed = True
-
-        return modules_response
-
-    def export_to_file(self, row, file_path):
-        with open(file_path, 'a', encoding='utf-8') as f:
-            cw = csv.writer(f, delimiter='\t')
-            cw.writerow(row)
+        from fetcher import fetch
+
+        return fetch([tweet_id], coinform_endpoint(), query_timeout=self.query_timeout)[tweet_id]
+
+    def _ingest(self, src_file, dest_file):
+        '''
+        Reads the english tweets of the misinfome dump in chunks, only the needed columns and with categorical dtypes,
+        and writes the compact table of unique tweet ids with url and fact-checker label to dest_file. Later runs
+        read dest_file instead of the dump.
+        :return: tweet_id, url and factchecker_label of the tweets
+        :rtype: pandas.DataFrame
+        '''
+        if dest_file.exists():
+            return pd.read_csv(dest_file, sep='\t',
+                               dtype={'tweet_id': str, 'url': str, 'factchecker_label': 'category'})
+        chunks = []
+        with timing.stage('ingest') as info:
+            for chunk in pd.read_csv(src_file, sep='\t', usecols=list(INGEST_DTYPES), dtype=INGEST_DTYPES,
+                                     chunksize=INGEST_CHUNK_SIZE):
+                # string methods of categorical columns only run on the categories
+                chunk = chunk[(chunk['lang'] == 'en') & chunk['source'].str.contains('twitter', na=False)]
+                chunk = chunk.assign(tweet_id=parse_ids(chunk['url'])).dropna(subset=['tweet_id'])
+                chunks.append(chunk[['tweet_id', 'url', 'factchecker_label']].drop_duplicates('tweet_id'))
+            data = pd.concat(chunks, ignore_index=True).drop_duplicates('tweet_id', ignore_index=True)
+            data['factchecker_label'] = data['factchecker_label'].astype('category')
+            info['rows'] = len(data)
+        data.to_csv(dest_file, sep='\t', index=False)
+        logger.info('{} unique english tweets written to {}'.format(len(data), dest_file))
+        return data
 
     def from_misinfome(self):
         '''
         Retrieves english tweets from misinfome collection and record tweet ids and labels.
+        Responses are kept in a store keyed by tweet id, reruns only request the tweets which are not stored yet.
         :return:
         :rtype:
         '''
@@ -422,70 +541,242 @@ class Sample_Generator():
         src_file = DATA_DIR / 'misinfome' / 'joined_tables.tsv'
         fc_labels_file = DATA_DIR / 'misinfome' / 'fact_checking_gold_labels.tsv'
         responses_file = DATA_DIR / 'misinfome' / 'misinfome_responses.csv'
+        store_file = DATA_DIR / 'misinfome' / 'responses.sqlite'
         file_path = DATA_DIR / 'misinfome/rule-responses/export.csv'
 
-        if not os.path.isfile(dest_file):
-            data = pd.read_csv(src_file, sep='\t')
-            mask = (data['lang'] == 'en') & (data['source'].str.contains('twitter'))
-            data = data[mask]
-            data = data[['url', 'factchecker_label']]
-            if not fc_labels_file.exists():
-                fc_labels = pd.DataFrame(pd.unique(data['factchecker_label']))
-                fc_labels.to_csv(fc_labels_file)
-
-            ## claim_conf,claim_cred,content_analys_conf,content_analys_cred,expected_credible,misinfome_conf,misinfome_cred
-            if not responses_file.exists():
-                self.export_to_file(['#id', 'url', 'claim_conf',
-                                     'claim_cred',
-                                     'content_analys_conf',
-                                     'content_analys_cred',
-                                     'misinfome_conf',
-                                     'misinfome_cred'], file_path)
-                for index, row in data.iterrows():
-                    row['id'] = parse_id(row['url'])
-                    logger.info(row['id'])
-                    response = self._request(row['url'])
-                    if response:
-                        row_obj = {
-                            'id': row['id'],
-                            'url': row['url'],
-                            'claim_conf': response['claim_conf'],
-                            'claim_cred': response['claim_cred'],
-                            'content_analys_conf': response['content_analys_conf'],
-                            'content_analys_cred': response['content_analys_cred'],
-                            'misinfome_conf': response['misinfome_conf'],
-                            'misinfome_cred': response['misinfome_cred'],
-                        }
-                        # row['expected_credible'] = self._map_label(row['factchecker_label'])
-                        self.export_to_file(list(row_obj.values()), file_path)
-                # data[['claim_conf', 'claim_cred', 'content_analys_conf', 'content_analys_cred', 'misinfome_conf',
-                #       'misinfome_cred']].to_csv(responses_file)
-            # todo add final data csv
+        data = self._ingest(src_file, dest_file)
+        if not fc_labels_file.exists():
+            fc_labels = pd.DataFrame(pd.unique(data['factchecker_label']))
+            fc_labels.to_csv(fc_labels_file)
 
+        ## claim_conf,claim_cred,content_analys_conf,content_analys_cred,expected_credible,misinfome_conf,misinfome_cred
+        if not responses_file.exists():
+            from fetcher import fetch
 
-if __name__ == '__main__':
+            endpoint = coinform_endpoint()
+            with ResponseStore(store_file) as store:
+                tweet_urls = store.missing(data['url'], ttl=self.response_ttl)
+                logger.info('{} tweets without stored response'.format(len(tweet_urls)))
+
+                def on_result(url, response):
+                    logger.info(parse_id(url))
+                    if response:
+                        # row['expected_credible'] = self._map_label(row['factchecker_label'])
+                        store.put(url, response)
+
+                fetch(tweet_urls, endpoint, concurrency=self.concurrency,
+                      query_timeout=self.query_timeout, on_result=on_result)
+                os.makedirs(file_path.parent, exist_ok=True)
+                store.export_to_file(file_path)
+            # data[['claim_conf', 'claim_cred', 'content_analys_conf', 'content_analys_cred', 'misinfome_conf',
+            #       'misinfome_cred']].to_csv(responses_file)
+        if file_path.exists():
+            from collection import GOLD_FILES, write_cases
+
+            # cases of the responses with the gold labels of the notebook, evaluated with the synthetic cases
+            write_cases(file_path, GOLD_FILES, DATA_DIR)
+
+
+class BandValidator():
+    '''
+    Checks every generated row against the declared bands of its mode: the credibility of each module lies in the
+    band of the expected label (the neighbour band for the disagreeing modules of some_agree), the confidence is
+    above the module threshold for high and below it for low confidence and the expected label is the one of the
+    band, not_verifiable for all_not_verified. A chunk is checked with two comparisons against bounds of shape
+    (modules, 2), the offending rows are only located if the chunk has any. The bands are the declared ones, modules
+    with boundaries which are not descending have overlapping bands and are reported as configuration violation.
+    '''
+
+    def __init__(self, generator, mode, case, max_rows=1000, fail=False):
+        '''
+        :param generator: generator of the chunks
+        :type generator: Sample_Generator
+        :param case: name of the case in the report
+        :type case: str
+        :param max_rows: violations kept for the report, all are counted
+        :type max_rows: int
+        :param fail: raise ValueError on a configuration violation or on the first chunk with violations, before it is
+            written
+        :type fail: bool
+        '''
+        self.generator = generator
+        self.mode = mode
+        self.case = case
+        self.max_rows = max_rows
+        self.fail = fail
+        self.modules = list(generator.modules)
+        self.rows = 0
+        self.offending_rows = 0
+        self.violations = np.zeros((len(self.modules), 2), dtype=np.int64)
+        self.label_violations = 0
+        self._records = []
+        self._n_records = 0
+        self.configuration_violations = {module: list(cred) for module, (cred, conf) in generator.modules.items()
+                                         if any(high < low for high, low in zip(cred, cred[1:]))}
+        if self.fail and self.configuration_violations:
+            self.finish()
+
+    def _bounds(self, bands, high_conf):
+        '''
+        :param bands: label band of the credibility of each module
+        :param high_conf: high confidence of each module
+        :return: lowest and highest allowed values of shape (modules, 2)
+        :rtype: tuple
+        '''
+        low = np.empty((len(self.modules), 2), dtype=np.float32)
+        high = np.empty((len(self.modules), 2), dtype=np.float32)
+        for j, module in enumerate(self.modules):
+            cred = self.generator.modules[module][0]
+            # declared band between the boundaries, unlike _band_bounds not sorted
+            low[j, CRED] = -1 if bands[j] == len(cred) else cred[bands[j]]
+            high[j, CRED] = 1 if bands[j] == 0 else cred[bands[j] - 1]
+            conf = self.generator.modules[module][1]
+            low[j, CONF], high[j, CONF] = (conf, 1) if high_conf[j] else (0, conf)
+        return low, high
+
+    def _parts(self, task):
+        '''
+        :return: (rows, low, high) of the parts of a chunk with the same bounds
+        :rtype: list
+        '''
+        _, i, chunk, start, size, extra = task
+        n_modules = len(self.modules)
+        if self.mode == 'some_agree':
+            section, random_modules, confidence_density = extra
+            agreed = [module in random_modules['agree'] for module in self.modules]
+            bands = [i if agree else (i + 1 if i == 0 else i - 1) for agree in agreed]
+            return [(slice(0, size),) + self._bounds(bands, [agree or confidence_density for agree in agreed])]
+        if self.mode == 'all_agree_some_high':
+            n_high = self.generator._n_high(i, start, size)
+            return [(slice(0, n_high),) + self._bounds([i] * n_modules, [True] * n_modules),
+                    (slice(n_high, size),) + self._bounds([i] * n_modules, [False] * n_modules)]
+        return [(slice(0, size),) + self._bounds([i] * n_modules, [self.mode == 'all_agree_all_high'] * n_modules)]
+
+    def _label(self, i):
+        return self.generator.labels['not_verifiable'] if self.mode == 'all_not_verified' else i
+
+    def __call__(self, task, data):
+        '''
+        Checks one chunk of the task
+        '''
+        values = data['values']
+        expected = data['expected_credible']
+        label = self._label(task[1])
+        parts = self._parts(task)
+        with timing.stage('validate', rows=expected.shape[0], mode=self.mode):
+            valid = bool((expected == label).all())
+            for rows, low, high in parts:
+                part = values[rows]
+                valid = valid and bool((part >= low).all()) and bool((part <= high).all())
+        offset = self.rows
+        # counted before the violations are located, so a failing validator reports the rows of this chunk too
+        self.rows += expected.shape[0]
+        if not valid:
+            self._locate(task, values, expected, label, parts, offset)
+
+    def _locate(self, task, values, expected, label, parts, offset):
+        '''
+        Counts and records the violations of a chunk, NaN values count as outside of their band
+        :param offset: row of the case where the chunk starts
+        :type offset: int
+        '''
+        _, i, chunk, start, size, extra = task
+        offending = expected != label
+        records = []
+        for rows, low, high in parts:
+            outside = ~((values[rows] >= low) & (values[rows] <= high))
+            self.violations += outside.sum(axis=0)
+            offending[rows] |= outside.any(axis=(1, 2))
+            row, module, column = np.nonzero(outside)
+            row = row + (rows.start or 0)
+            records.append(pd.DataFrame({
+                'row': offset + row, 'band': i, 'chunk': chunk, 'module': np.asarray(self.modules)[module],
+                'column': np.where(column == CRED, 'cred', 'conf'), 'value': values[row, module, column],
+                'low': low[module, column], 'high': high[module, column]}))
+        wrong_label = np.flatnonzero(expected != label)
+        self.label_violations += len(wrong_label)
+        records.append(pd.DataFrame({'row': offset + wrong_label, 'band': i, 'chunk': chunk, 'module': '',
+                                     'column': 'expected_credible', 'value': expected[wrong_label], 'low': label,
+                                     'high': label}))
+        self.offending_rows += int(offending.sum())
+        if self.mode == 'some_agree':
+            for record in records:
+                record.insert(1, 'section', extra[0])
+        for record in records:
+            if self._n_records < self.max_rows and len(record):
+                self._records.append(record.iloc[:self.max_rows - self._n_records])
+                self._n_records += len(self._records[-1])
+        if self.fail:
+            self.finish()
+
+    def summary(self):
+        '''
+        :return: counts of the violations and the configuration of the case
+        :rtype: dict
+        '''
+        generator = self.generator
+        return {'case': self.case, 'mode': self.mode, 'rows': self.rows, 'offending_rows': self.offending_rows,
+                'violations': {module: {'cred': int(self.violations[j, CRED]), 'conf': int(self.violations[j, CONF])}
+                               for j, module in enumerate(self.modules)},
+                'expected_credible': self.label_violations,
+                'configuration_violations': self.configuration_violations,
+                'configuration': {'modules': generator.modules, 'n_samples': generator.total_sample,
+                                  'chunk_size': generator.chunk_size, 'seed': generator.seed}}
+
+    def finish(self):
+        '''
+        Prints the result, cases with violations get a report of the offending rows in data/validation/{case}.csv
+        and of the counts and configuration violations in .json
+        :raises ValueError: on violations if the validator fails
+        '''
+        if not self.offending_rows and not self.configuration_violations:
+            print('Validated {} rows of {}'.format(self.rows, self.case))
+            return
+        report_dir = DATA_DIR / VALIDATION_DIR
+        os.makedirs(report_dir, exist_ok=True)
+        messages = []
+        if self.configuration_violations:
+            messages.append('Credibility boundaries of {} are not descending, their bands overlap, see {}'.format(
+                self.configuration_violations, report_dir / (self.case + '.json')))
+        if self._records:
+            pd.concat(self._records, ignore_index=True).to_csv(report_dir / (self.case + '.csv'), index=False)
+        if self.offending_rows:
+            messages.append('{} of {} rows of {} are outside of their bands, see {}'.format(
+                self.offending_rows, self.rows, self.case, report_dir / (self.case + '.csv')))
+        with open(report_dir / (self.case + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=4)
+        message = '. '.join(messages)
+        if self.fail:
+            raise ValueError(message)
+        logger.warning(message)
+
+    def validated(self, tasks, chunks):
+        '''
+        Checks the chunks of the tasks while they are passed on
+        :return: chunks
+        :rtype: generator
+        '''
+        for task, data in zip(tasks, chunks):
+            self(task, data)
+            yield data
+        self.finish()
+
+
+def main(argv=None, **defaults):
+    '''
+    :param argv: command line arguments, by default sys.argv
+    :type argv: list
+    :param defaults: defaults of the arguments, e.g. sample_mode
+    '''
     print('This script generates samples for testing rules')
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--n_samples', type=int, default=20)
-    parser.add_argument('--misinfome_cred', action='store',
-                        type=float, nargs=4, default=[0.66, 0.33, -0.33, -0.66],
-                        help="Examples: --misinfome_cred item1 item2")
-    parser.add_argument('--content_analysis_cred', action='store',
-                        type=float, nargs=4, default=[0.6, 0.3, -0.3, -0.6],
-                        help="Examples: --content_analysis_cred item1 item2")
-    parser.add_argument('--claim_cred', action='store',
-                        type=float, nargs=4, default=[0.5, 0.25, -0.5, -0.25],
-                        help="Examples: --claim_cred item1 item2")
-    parser.add_argument('--misinfome_conf',
-                        type=float, default=0.5)
-    parser.add_argument('--content_analysis_conf',
-                        type=float, default=0.6)
-    parser.add_argument('--claim_conf', type=float, default=0.7)
-    parser.add_argument('--n_modules', type=int, default=3, help="total number of modules")
-    parser.add_argument('--sample_mode', type=str, default='external_misinfome',
-                        help="select sample mode, all_not_verified, all_agree_all_high or some agree")
-
-    args = parser.parse_args()
+    parser = generate_parser()
+    parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+    setup_logging()
+    timing.configure(args.timings, args.profile)
+    if args.profile:
+        # the profiler only sees the stages of this process
+        args.workers = 1
     sample_gen = Sample_Generator(args)
     mode = args.sample_mode
 
@@ -499,5 +790,20 @@ if __name__ == '__main__':
         sample_gen.some_agree()
     elif mode == 'all_agree_some_high':
         sample_gen.all_agree_some_high()
+    elif mode == 'all':
+        sample_gen.all_modes()
     elif mode == 'external_misinfome':
         sample_gen.from_misinfome()
+    timing.dump_profile()
+
+
+def generate(argv=None):
+    main(argv, sample_mode='all')
+
+
+def collect(argv=None):
+    main(argv, sample_mode='external_misinfome')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import timing
+
+'''
+Reading and writing of generated cases
+
+The generator produces chunks {'values': float32 array of shape (rows, modules, 2) with the cred and conf of each
+module, 'expected_credible': int8 label codes}. A case is either a csv file with the columns {module}_cred,
+{module}_conf and expected_credible or a binary case directory with
+ - values.bin: float32 array of shape (rows, modules, 2) with the cred and conf of each module
+ - expected_credible.bin: int8 label codes
+ - meta.json: rows, module column names and labels, written last so unfinished cases are never loaded
+Binary cases are loaded memory-mapped without copying.
+'''
+
+# csv column prefix of each module, in module order of the binary cases
+MODULE_COLUMNS = ['misinfome', 'content_analys', 'claim']
+
+META_FILE = 'meta.json'
+VALUES_FILE = 'values.bin'
+LABELS_FILE = 'expected_credible.bin'
+
+
+class BinaryCaseWriter():
+    def __init__(self, path, labels, modules=MODULE_COLUMNS):
+        '''
+        :param path: directory of the case
+        :type path: Path
+        :param labels: {label: code}
+        :type labels: dict
+        :param modules: csv column prefixes of the modules
+        :type modules: list
+        '''
+        self.path = Path(path)
+        self.labels = labels
+        self.modules = modules
+        self.rows = 0
+        os.makedirs(self.path, exist_ok=True)
+        if (self.path / META_FILE).exists():
+            os.remove(self.path / META_FILE)
+        self._values = open(self.path / VALUES_FILE, 'wb')
+        self._expected = open(self.path / LABELS_FILE, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(complete=exc_type is None)
+
+    def write(self, data):
+        '''
+        :param data: chunk with values of shape (rows, modules, 2) and expected label codes
+        :type data: dict
+        '''
+        size = data['expected_credible'].shape[0]
+        with timing.stage('write', rows=size, format='binary'):
+            np.ascontiguousarray(data['values'], dtype=np.float32).tofile(self._values)
+            np.asarray(data['expected_credible'], dtype=np.int8).tofile(self._expected)
+        self.rows += size
+
+    def close(self, complete=True):
+        self._values.close()
+        self._expected.close()
+        if complete:
+            labels = sorted(self.labels, key=self.labels.get)
+            with open(self.path / META_FILE, 'w', encoding='utf-8') as f:
+                json.dump({'rows': self.rows, 'modules': self.modules, 'labels': labels}, f, indent=4)
+
+
+class CaseWriter():
+    '''
+    Writes the chunks of a case to {path}.csv and/or the binary case directory {path}
+    '''
+
+    def __init__(self, path, output_format, labels, modules=MODULE_COLUMNS):
+        self.path = Path(path)
+        self.modules = modules
+        self.label_names = np.asarray(sorted(labels, key=labels.get), dtype=object)
+        self.csv_path = self.path.with_name(self.path.name + '.csv') if output_format in ('csv', 'both') else None
+        self.binary = BinaryCaseWriter(self.path, labels, modules) if output_format in ('binary', 'both') else None
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(complete=exc_type is None)
+
+    def write(self, data):
+        size = data['expected_credible'].shape[0]
+        if self.binary is not None:
+            self.binary.write(data)
+        if self.csv_path is not None:
+            with timing.stage('assemble', rows=size, format='csv'):
+                chunk = csv_frame(data['values'], self.label_names[data['expected_credible']], self.modules,
+                                  self.rows)
+            with timing.stage('write', rows=size, format='csv'):
+                chunk.to_csv(self.csv_path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0)
+        self.rows += size
+
+    def close(self, complete=True):
+        '''
+        :param complete: False removes the csv file, the binary case is left without meta data, so an incomplete case
+            is never evaluated
+        '''
+        if self.binary is not None:
+            self.binary.close(complete)
+        if not complete and self.csv_path is not None and self.csv_path.exists():
+            os.remove(self.csv_path)
+
+
+def csv_frame(values, expected_labels, modules, start=0):
+    '''
+    :param values: cred and conf of shape (rows, modules, 2)
+    :param expected_labels: expected labels
+    :param modules: csv column prefixes of the modules
+    :param start: row index of the first row
+    :return: csv columns in sorted order
+    :rtype: pandas.DataFrame
+    '''
+    data = {'expected_credible': expected_labels}
+    for i, module in enumerate(modules):
+        data[module + '_cred'] = values[:, i, 0]
+        data[module + '_conf'] = values[:, i, 1]
+    return pd.DataFrame({column: data[column] for column in sorted(data)},
+                        index=pd.RangeIndex(start, start + values.shape[0]))
+
+
+def is_binary_case(path):
+    return (Path(path) / META_FILE).exists()
+
+
+def list_cases(data_dir):
+    '''
+    :return: {case name: path}, binary cases replace csv files with the same name
+    :rtype: dict
+    '''
+    cases = {path.stem: path for path in sorted(Path(data_dir).glob('*.csv'))}
+    cases.update({path.parent.name: path.parent for path in sorted(Path(data_dir).glob('*/' + META_FILE))})
+    return cases
+
+
+def case_modules(path):
+    '''
+    :return: csv column prefixes of the modules of a case, in stored order
+    :rtype: list
+    '''
+    if is_binary_case(path):
+        with open(Path(path) / META_FILE, encoding='utf-8') as f:
+            return json.load(f)['modules']
+    columns = pd.read_csv(path, nrows=0).columns
+    return [column[:-len('_cred')] for column in columns if column.endswith('_cred')]
+
+
+def load_binary_case(path):
+    '''
+    :return: values memmap of shape (rows, modules, 2), expected label codes memmap and meta data
+    :rtype: tuple
+    '''
+    path = Path(path)
+    with open(path / META_FILE, encoding='utf-8') as f:
+        meta = json.load(f)
+    shape = (meta['rows'], len(meta['modules']), 2)
+    if meta['rows'] == 0:
+        return np.empty(shape, dtype=np.float32), np.empty(0, dtype=np.int8), meta
+    values = np.memmap(path / VALUES_FILE, dtype=np.float32, mode='r', shape=shape)
+    expected = np.memmap(path / LABELS_FILE, dtype=np.int8, mode='r', shape=(meta['rows'],))
+    return values, expected, meta
+
+
+def load_case(path, modules, labels):
+    '''
+    Loads a case for the evaluation
+    :param path: csv file or binary case directory
+    :type path: Path
+    :param modules: csv column prefixes of the modules in column order of the result arrays
+    :type modules: list
+    :param labels: {label: code}
+    :type labels: dict
+    :return: creds and confs of shape (rows, modules), expected label codes
+    :rtype: tuple
+    '''
+    if is_binary_case(path):
+        with timing.stage('load', case=Path(path).name) as info:
+            values, expected, meta = load_binary_case(path)
+            info['rows'] = meta['rows']
+        order = [meta['modules'].index(module) for module in modules]
+        if order != list(range(len(meta['modules']))):
+            values = values[:, order]
+        codes = np.asarray([labels[label] for label in meta['labels']], dtype=np.int8)
+        if (codes != np.arange(len(codes))).any():
+            expected = codes[expected]
+        return values[..., 0], values[..., 1], expected
+    with timing.stage('load', case=Path(path).name) as info:
+        data = pd.read_csv(path, low_memory=False)
+        info['rows'] = len(data)
+    with timing.stage('build_requests', rows=len(data)):
+        creds, confs = chunk_arrays(data, modules)
+        expected = data.expected_credible.map(labels).to_numpy()
+    return creds, confs, expected
+
+
+def chunk_arrays(data, modules):
+    '''
+    :param data: csv columns of a case, DataFrame or {column: values}
+    :param modules: csv column prefixes of the modules in column order of the result arrays
+    :type modules: list
+    :return: creds and confs of shape (rows, modules)
+    :rtype: tuple
+    '''
+    creds = np.column_stack([np.asarray(data[module + '_cred'], dtype=np.float64) for module in modules])
+    confs = np.column_stack([np.asarray(data[module + '_conf'], dtype=np.float64) for module in modules])
+    return creds, confs
+
+
+def export_csv(path, csv_path, chunk_size=1000000):
+    '''
+    Writes a binary case as csv file in the column layout of the generator
+    '''
+    values, expected, meta = load_binary_case(path)
+    labels = np.asarray(meta['labels'], dtype=object)
+    for start in range(0, max(meta['rows'], 1), chunk_size):
+        stop = min(start + chunk_size, meta['rows'])
+        chunk = csv_frame(values[start:stop], labels[expected[start:stop]], meta['modules'], start)
+        chunk.to_csv(csv_path, mode='w' if start == 0 else 'a', header=start == 0)
+
+
+if __name__ == '__main__':
+    print('This script exports binary cases as csv files')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('cases', nargs='+', help="binary case directories")
+    args = parser.parse_args()
+    for case in args.cases:
+        case = Path(case)
+        export_csv(case, case.parent / (case.name + '.csv'))
@@ -0,0 +1,92 @@
+import argparse
+import time
+import uuid
+
+import numpy as np
+from aiohttp import web
+
+'''
+Local stub of the policy manager endpoints used by the tweet fetcher
+
+POST /twitter/tweet                 -> {'query_id': ...}
+GET  /response/{query_id}/debug     -> in_progress, partly_done and finally done with module responses
+'''
+
+MODULE_CODES = ['claimcredibility', 'contentanalysis', 'misinfome']
+
+
+def _module_responses(rng):
+    creds = rng.uniform(-1, 1, size=3)
+    confs = rng.uniform(0, 1, size=3)
+    return {
+        'claimcredibility_tweet_claim_credibility_0_credibility': creds[0],
+        'claimcredibility_tweet_claim_credibility_0_confidence': confs[0],
+        'contentanalysis_credibility': creds[1],
+        'contentanalysis_confidence': confs[1],
+        'misinfome_credibility_value': creds[2],
+        'misinfome_credibility_confidence': confs[2],
+    }
+
+
+def make_app(delay=1.0, jitter=0.0, failure_rate=0.0, seed=42):
+    '''
+    :param delay: seconds until a query is done, the first half of it the query is in_progress then partly_done
+    :type delay: float
+    :param jitter: uniform random seconds added to the delay of each query
+    :type jitter: float
+    :param failure_rate: probability that a module responds with error code 500
+    :type failure_rate: float
+    :return: stub application
+    :rtype: aiohttp.web.Application
+    '''
+    rng = np.random.default_rng(seed)
+    queries = {}
+
+    async def submit(request):
+        await request.json()
+        query_id = uuid.uuid4().hex
+        queries[query_id] = time.monotonic() + delay + rng.uniform(0, jitter)
+        return web.json_response({'query_id': query_id})
+
+    async def respond(request):
+        query_id = request.match_info['query_id']
+        if query_id not in queries:
+            return web.json_response({'status': 'not_found'}, status=404)
+        remaining = queries[query_id] - time.monotonic()
+        if remaining > delay / 2:
+            return web.json_response({'status': 'in_progress'})
+        if remaining > 0:
+            return web.json_response({'status': 'partly_done'})
+        del queries[query_id]
+        codes = {module: 500 if rng.uniform() < failure_rate else 200 for module in MODULE_CODES}
+        return web.json_response({'status': 'done', 'module_response_code': codes,
+                                  'flattened_module_responses': _module_responses(rng)})
+
+    app = web.Application()
+    app.router.add_post('/twitter/tweet', submit)
+    app.router.add_get('/response/{query_id}/debug', respond)
+    return app
+
+
+async def start(port=0, **kwargs):
+    '''
+    Starts the stub in the running event loop
+    :return: runner to clean up and the endpoint of the stub
+    :rtype: tuple
+    '''
+    runner = web.AppRunner(make_app(**kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://127.0.0.1:{}'.format(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds until a query is done")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random seconds added to the delay")
+    parser.add_argument('--failure_rate', type=float, default=0.0, help="probability of a failed module")
+    args = parser.parse_args()
+    web.run_app(make_app(delay=args.delay, jitter=args.jitter, failure_rate=args.failure_rate), port=args.port)
@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from aggregators import get_batch
+from arguments import DATA_DIR, SUMMARY_DIR, generate_parser, sweep_parser
+from evaluation import summary_name
+from metrics import ConfusionMatrix
+from sample_generator import CONF, CRED, Sample_Generator
+
+'''
+Threshold sweep
+
+Generates the samples of every combination of module thresholds and sample modes in memory, evaluates the
+aggregation function on them directly and writes one results table indexed by configuration.
+'''
+
+CRED_ARGS = ['misinfome_cred', 'content_analysis_cred', 'claim_cred']
+CONF_ARGS = ['misinfome_conf', 'content_analysis_conf', 'claim_conf']
+
+
+def _cred_values(values):
+    '''
+    Splits the values of a cred argument into threshold sets of 4
+    '''
+    if len(values) % 4 != 0:
+        raise ValueError('Credibility thresholds are given in sets of 4, got {} values'.format(len(values)))
+    return [tuple(values[i:i + 4]) for i in range(0, len(values), 4)]
+
+
+def _conf_values(values):
+    '''
+    A single confidence or start, stop and step of a range including stop
+    '''
+    if len(values) == 1:
+        return [values[0]]
+    if len(values) != 3:
+        raise ValueError('Confidence is given as single value or start stop step, got {} values'.format(len(values)))
+    start, stop, step = values
+    return [round(value, 10) for value in np.arange(start, stop + step / 2, step)]
+
+
+def configurations(args):
+    '''
+    :return: all combinations of the threshold arguments and sample modes
+    :rtype: list
+    '''
+    grid = [_cred_values(getattr(args, name)) for name in CRED_ARGS] + \
+           [_conf_values(getattr(args, name)) for name in CONF_ARGS] + [args.sample_mode]
+    return [dict(zip(CRED_ARGS + CONF_ARGS + ['sample_mode'], values)) for values in product(*grid)]
+
+
+def _evaluated(chunks, matrix, aggregate):
+    for data in chunks:
+        values = data['values']
+        matrix.update(data['expected_credible'], aggregate(values[..., CRED], values[..., CONF]))
+        yield data
+
+
+def case_name(index, configuration, args):
+    '''
+    :return: name of the saved samples of a configuration, unique within the sweep of an aggregation function
+    :rtype: str
+    '''
+    return 'sweep_{}_{}_{}'.format(summary_name(args.aggregate_func), index, configuration['sample_mode'])
+
+
+def evaluate_configuration(index, configuration, args):
+    '''
+    Generates the samples of one configuration and evaluates the aggregation function on them
+    :param index: position of the configuration in the sweep, names its saved samples
+    :type index: int
+    :return: configuration and results
+    :rtype: dict
+    '''
+    generator_args = generate_parser().parse_args([])
+    for name, value in configuration.items():
+        setattr(generator_args, name, list(value) if name in CRED_ARGS else value)
+    generator_args.n_samples = args.n_samples
+    generator_args.chunk_size = args.chunk_size
+    generator_args.output_format = args.output_format
+    generator_args.seed = args.seed
+
+    start = time.perf_counter()
+    sample_gen = Sample_Generator(generator_args)
+    matrix = ConfusionMatrix()
+    mode = configuration['sample_mode']
+    chunks = _evaluated(sample_gen.chunks(mode), matrix, get_batch(args.aggregate_func))
+    if args.save_samples:
+        sample_gen._save(mode, chunks, DATA_DIR / case_name(index, configuration, args))
+    else:
+        for _ in chunks:
+            pass
+
+    results = {name: ' '.join(str(v) for v in value) if name in CRED_ARGS else value
+               for name, value in configuration.items()}
+    results['aggregate_func'] = args.aggregate_func
+    if args.save_samples:
+        results['case'] = case_name(index, configuration, args)
+    results.update(matrix.results())
+    results['seconds'] = time.perf_counter() - start
+    return results
+
+
+def run(args):
+    configs = configurations(args)
+    print('Sweeping {} configurations'.format(len(configs)))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        all_results = list(executor.map(evaluate_configuration, range(len(configs)), configs, [args] * len(configs)))
+
+    summary_dir = DATA_DIR / SUMMARY_DIR
+    os.makedirs(summary_dir, exist_ok=True)
+    name = 'sweep_{}'.format(summary_name(args.aggregate_func))
+    with open(summary_dir / (name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(all_results, f, ensure_ascii=False, indent=4)
+    table = pd.DataFrame(all_results).set_index(CRED_ARGS + CONF_ARGS + ['sample_mode'])
+    table.to_csv(summary_dir / (name + '.csv'))
+    print(table[['accuracy', 'fscore_macro']].to_string())
+
+
+def main(argv=None):
+    run(sweep_parser().parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+
+'''
+Per-stage timing and profiling
+
+Stages of the pipeline are wrapped in `with stage(name) as info`, info takes the row count and other fields of the
+stage. When a timings file is configured every stage is written to it as one json line
+{"stage": ..., "seconds": ..., "rows": ..., "pid": ...}, '-' writes the lines to stderr. The stage selected for
+profiling runs under cProfile, its statistics are collected over all runs of the stage and written by dump_profile.
+Without configuration stages cost one function call.
+'''
+
+_timings = None
+_profile_stage = None
+_profiler = None
+
+
+def configure(timings=None, profile=None):
+    '''
+    :param timings: json lines file of the stage timings, '-' for stderr, None disables the timings
+    :type timings: str
+    :param profile: name of the stage to profile
+    :type profile: str
+    '''
+    global _timings, _profile_stage, _profiler
+    _timings = timings
+    _profile_stage = profile
+    _profiler = cProfile.Profile() if profile else None
+
+
+def settings():
+    '''
+    :return: arguments of configure for the current settings, e.g. as initargs of worker processes
+    :rtype: tuple
+    '''
+    return _timings, _profile_stage
+
+
+def record(name, seconds, rows=None, **fields):
+    '''
+    Writes the timing of a stage as one json line
+    '''
+    if _timings is None:
+        return
+    line = json.dumps(dict({'stage': name, 'seconds': seconds, 'rows': rows, 'pid': os.getpid()}, **fields))
+    if _timings == '-':
+        print(line, file=sys.stderr)
+        return
+    with open(_timings, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+@contextmanager
+def stage(name, rows=None, **fields):
+    '''
+    Times the body of the with statement as stage name
+    :return: fields of the json line, e.g. info['rows'] once the rows are known
+    :rtype: dict
+    '''
+    info = dict(fields, rows=rows)
+    if _timings is None and _profile_stage != name:
+        yield info
+        return
+    profiling = _profile_stage == name
+    if profiling:
+        _profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        seconds = time.perf_counter() - start
+        if profiling:
+            _profiler.disable()
+        record(name, seconds, **info)
+
+
+def dump_profile(path=None, top=20):
+    '''
+    Writes the cProfile statistics of the profiled stage to path, default {stage}.prof, and prints the functions
+    with the highest cumulative time
+    '''
+    if _profiler is None:
+        return
+    path = path or '{}.prof'.format(_profile_stage)
+    _profiler.dump_stats(path)
+    print('Profile of stage {} written to {}'.format(_profile_stage, path))
+    pstats.Stats(_profiler).sort_stats('cumulative').print_stats(top)
+
+
+def add_arguments(parser, hot_stage):
+    '''
+    Adds --timings and --profile to an argument parser, --profile without value profiles hot_stage
+    '''
+    parser.add_argument('--timings', type=str, default=None,
+                        help="json lines file of the per-stage timings and row counts, - for stderr")
+    parser.add_argument('--profile', type=str, nargs='?', const=hot_stage, default=None,
+                        help="profile a stage with cProfile in this process, default {}".format(hot_stage))
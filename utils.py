@@ -6,3 +6,49 @@ RE_TWITTER_TWEET_ID = re.compile('^https\:\/\/twitter.com\/.*\/status\/(\d+).*')
 def parse_id(tweet_url):
     match = RE_TWITTER_TWEET_ID.match(tweet_url)
     return match.group(1) if match is not None else None
+
+
+def parse_ids(tweet_urls):
+    '''
+    Vectorized parse_id
+    :type tweet_urls: pandas.Series
+    :return: tweet ids, NaN for urls which are no tweets
+    :rtype: pandas.Series
+    '''
+    return tweet_urls.str.extract(RE_TWITTER_TWEET_ID, expand=False)
+
+# value of the modules which failed or did not respond
+FAILED_RESPONSE = -100
+
+
+def parse_module_responses(response):
+    '''
+    Extracts credibility and confidence values of the modules from a debug response of the policy manager
+    :param response: json response of fetcher.RESPONSE_PATH
+    :type response: dict
+    :return: {claim_conf, claim_cred, content_analys_conf, content_analys_cred, misinfome_conf, misinfome_cred}
+    :rtype: dict
+    '''
+    response_codes = response.get('module_response_code', {})
+    flattened = response.get('flattened_module_responses', {})
+    modules_response = {}
+    if response_codes.get('claimcredibility') == 200 and \
+            'claimcredibility_tweet_claim_credibility_0_confidence' in flattened:
+        modules_response['claim_conf'] = flattened['claimcredibility_tweet_claim_credibility_0_confidence']
+        modules_response['claim_cred'] = flattened['claimcredibility_tweet_claim_credibility_0_credibility']
+    else:
+        modules_response['claim_conf'] = FAILED_RESPONSE
+        modules_response['claim_cred'] = FAILED_RESPONSE
+    if response_codes.get('contentanalysis') == 200 and 'contentanalysis_credibility' in flattened:
+        modules_response['content_analys_conf'] = flattened['contentanalysis_confidence']
+        modules_response['content_analys_cred'] = flattened['contentanalysis_credibility']
+    else:
+        modules_response['content_analys_conf'] = FAILED_RESPONSE
+        modules_response['content_analys_cred'] = FAILED_RESPONSE
+    if response_codes.get('misinfome') == 200 and 'misinfome_credibility_value' in flattened:
+        modules_response['misinfome_conf'] = flattened['misinfome_credibility_confidence']
+        modules_response['misinfome_cred'] = flattened['misinfome_credibility_value']
+    else:
+        modules_response['misinfome_conf'] = FAILED_RESPONSE
+        modules_response['misinfome_cred'] = FAILED_RESPONSE
+    return modules_response